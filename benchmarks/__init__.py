@@ -0,0 +1,2 @@
+"""Offline benchmarks for ytdb, run with python -m benchmarks.<name>
+"""
@@ -0,0 +1,396 @@
+"""Playback Benchmark
+    - Drives YoutubeCommands players against a stubbed yt-dlp and fake voice clients
+    - N guilds with M queued tracks each, random skips and stops
+    - Reports time to first audio, gaps between tracks, CPU per stream,
+      memory and event loop lag as JSON
+    - python -m benchmarks.playback --guilds 20 --tracks 5 --speed 10
+    - Track gaps only show the effect of prewarming at --speed 1, the player
+      waits in real time and misses the end of tracks played faster
+
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import contextlib
+import resource
+import tempfile
+import threading
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import discord
+import yt_dlp
+
+FRAME_SECONDS = 0.02
+# Bitrate of generated audio when the format sort asks for none, YouTube's best Opus track is about this
+DEFAULT_KBPS = 160
+
+
+class FakeYoutubeDL:
+    """Stand-in for yt_dlp.YoutubeDL serving generated audio
+
+    Ids are taken from the url, or made up from the search string. Downloads
+    write frames of silence, or a real Opus webm if use_ffmpeg is set, at the
+    bitrate an ``abr~`` entry in format_sort asks for.
+    """
+
+    extract_seconds = 0.05
+    download_seconds = 0.2
+    track_seconds = 5.0
+    use_ffmpeg = False
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def extract_info(self, url, download=False, process=True):
+        time.sleep(self.extract_seconds)
+        video_id = url.rsplit("v=", 1)[-1][-11:].rjust(11, "0")
+        info = {
+            "id": video_id,
+            "title": f"Benchmark Track {video_id}",
+            "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+            "thumbnail": None,
+            "duration": self.track_seconds,
+            "uploader": "Benchmark",
+            "acodec": "opus",
+            "ext": "webm" if self.use_ffmpeg else "frames",
+            "url": f"file://{video_id}",
+        }
+        if download:
+            time.sleep(self.download_seconds)
+            self._generate(self.prepare_filename(info))
+        return info
+
+    @property
+    def kbps(self) -> int:
+        for field in self.params.get("format_sort") or ():
+            if field.startswith("abr~"):
+                return int(field[4:])
+        return DEFAULT_KBPS
+
+    def prepare_filename(self, info):
+        return self.params["outtmpl"] % info
+
+    def _generate(self, filename):
+        if os.path.exists(filename):
+            return
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        partial = filename + ".part"
+        if self.use_ffmpeg:
+            subprocess.run(
+                [
+                    "ffmpeg", "-loglevel", "error", "-y",
+                    "-f", "lavfi", "-i", f"sine=frequency=440:duration={self.track_seconds}",
+                    "-c:a", "libopus", "-b:a", f"{self.kbps}k", "-f", "webm", partial,
+                ],
+                check=True,
+            )
+        else:
+            frames = int(self.track_seconds / FRAME_SECONDS)
+            frame_bytes = int(self.kbps * 1000 / 8 * FRAME_SECONDS)
+            with open(partial, "wb") as f:
+                # Frame size header for FrameFileSource
+                f.write(frame_bytes.to_bytes(2, "big"))
+                f.write(b"\x00" * frame_bytes * frames)
+        os.replace(partial, filename)
+
+
+class FrameFileSource(discord.AudioSource):
+    """Reads fixed size frames from a generated file, stands in for FFmpeg
+
+    The first read takes startup_seconds, like FFmpeg spawning and opening its input.
+    """
+
+    startup_seconds = 0.15
+
+    def __init__(self, filename):
+        self.file = open(filename, "rb")
+        self.frame_bytes = int.from_bytes(self.file.read(2), "big")
+        self.started = False
+
+    def read(self) -> bytes:
+        if not self.started:
+            self.started = True
+            time.sleep(self.startup_seconds)
+        return self.file.read(self.frame_bytes)
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self):
+        self.file.close()
+
+
+class FakeVoiceClient:
+    """Consumes frames on its own thread like discord.py's AudioPlayer, speed times faster than real time"""
+
+    speed = 1.0
+    connect_seconds = 0.1
+    frames_played = 0
+    _frames_lock = threading.Lock()
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.guild = channel.guild
+        self._connected = True
+        self._thread = None
+        self._stop = threading.Event()
+
+    def is_connected(self):
+        return self._connected
+
+    def is_playing(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def is_paused(self):
+        return False
+
+    async def move_to(self, channel):
+        await asyncio.sleep(self.connect_seconds)
+        self.channel = channel
+
+    async def disconnect(self, force=False):
+        self.stop()
+        self._connected = False
+        self.guild.voice_client = None
+
+    def play(self, source, *, after=None, **kwargs):
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._play, args=(source, after, self._stop), daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _play(self, source, after, stop):
+        delay = FRAME_SECONDS / self.speed
+        frames = 0
+        next_frame = time.perf_counter()
+        error = None
+        try:
+            while not stop.is_set():
+                if not source.read():
+                    break
+                frames += 1
+                next_frame += delay
+                time.sleep(max(0.0, next_frame - time.perf_counter()))
+        except Exception as ex:
+            error = ex
+        finally:
+            source.cleanup()
+            with FakeVoiceClient._frames_lock:
+                FakeVoiceClient.frames_played += frames
+            if after is not None:
+                after(error)
+
+
+class FakeMessage:
+    async def edit(self, **kwargs):
+        pass
+
+
+class FakeTextChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+    async def send(self, *args, **kwargs):
+        return FakeMessage()
+
+
+class FakeVoiceChannel:
+    def __init__(self, channel_id, guild):
+        self.id = channel_id
+        self.guild = guild
+        # Discord's default voice channel bitrate
+        self.bitrate = 64000
+
+    async def connect(self, reconnect=True, **kwargs):
+        await asyncio.sleep(FakeVoiceClient.connect_seconds)
+        self.guild.voice_client = FakeVoiceClient(self)
+        return self.guild.voice_client
+
+
+class FakeBot:
+    """The parts of commands.Bot the player looks things up in"""
+
+    shard_count = None
+    application_id = 1
+
+    def __init__(self):
+        self.channels = {}
+        self.guilds = {}
+
+    @property
+    def voice_clients(self):
+        return [g.voice_client for g in self.guilds.values() if g.voice_client is not None]
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    def add_guild(self, guild_id):
+        guild = SimpleNamespace(id=guild_id, voice_client=None, get_member=lambda user_id: None)
+        self.guilds[guild_id] = guild
+        voice = self.channels[10_000 + guild_id] = FakeVoiceChannel(10_000 + guild_id, guild)
+        text = self.channels[20_000 + guild_id] = FakeTextChannel(20_000 + guild_id)
+        context = SimpleNamespace(author=SimpleNamespace(id=30_000 + guild_id), channel=text)
+        return voice, context
+
+
+def _record(histogram, samples: list):
+    """Keeps raw samples of a metrics histogram so percentiles can be reported"""
+    observe = histogram.observe
+
+    def record(value):
+        samples.append(value)
+        observe(value)
+
+    histogram.observe = record
+
+
+def _summary(samples: list) -> dict:
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "max": samples[-1],
+    }
+
+
+async def _drive_guild(cog, bot, guild_id, tracks, skip_rate, stop, rng):
+    """Queues tracks like the play command would, then skips or stops at random"""
+    from ytdb.yt_utils import resolve
+
+    voice, context = bot.add_guild(guild_id)
+    player = cog._get_player(guild_id)
+    for i in range(tracks):
+        video_id = f"{guild_id:05d}{i:06d}"
+        requested_at = time.monotonic()
+        download_data = await resolve(f"https://www.youtube.com/watch?v={video_id}", str(guild_id))
+        player.add(download_data["url"], voice, download_data, context=context, requested_at=requested_at)
+        await player.start()
+
+    track_time = FakeYoutubeDL.track_seconds / FakeVoiceClient.speed
+    while player.is_playing:
+        await asyncio.sleep(track_time * rng.uniform(0.2, 1.0))
+        if stop and len(player.queue) <= tracks // 2:
+            await player.stop()
+        elif player.track_started is not None and rng.random() < skip_rate:
+            player.skip()
+    await player._task
+
+
+async def run_async(args) -> dict:
+    from ytdb import yt_metrics
+    from ytdb.yt_player import YoutubeCommands, YoutubeDiscordPlayer
+
+    first_audio, gaps, loop_lag = [], [], []
+    _record(yt_metrics.FIRST_AUDIO_SECONDS, first_audio)
+    _record(yt_metrics.TRACK_GAP_SECONDS, gaps)
+    _record(yt_metrics.LOOP_LAG_SECONDS, loop_lag)
+    if not args.ffmpeg:
+        YoutubeDiscordPlayer._create_source = staticmethod(
+            lambda queue_item, location: FrameFileSource(location)
+        )
+
+    bot = FakeBot()
+    cog = YoutubeCommands(bot)
+    rng = random.Random(args.seed)
+    stopped = set(rng.sample(range(args.guilds), int(args.guilds * args.stop_rate)))
+
+    lag_monitor = yt_metrics.LoopLagMonitor(interval=0.05)
+    lag_monitor.start()
+    cpu_before = time.process_time()
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+
+    await asyncio.gather(*(
+        _drive_guild(cog, bot, g, args.tracks, args.skip_rate, g in stopped, random.Random(rng.random()))
+        for g in range(args.guilds)
+    ))
+
+    wall = time.perf_counter() - started
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = time.process_time() - cpu_before + (
+        children.ru_utime + children.ru_stime - children_before.ru_utime - children_before.ru_stime
+    )
+    lag_monitor.stop()
+    for guild in bot.guilds.values():
+        if guild.voice_client is not None:
+            await guild.voice_client.disconnect()
+
+    audio_seconds = FakeVoiceClient.frames_played * FRAME_SECONDS
+    return {
+        "benchmark": "playback",
+        "guilds": args.guilds,
+        "tracks": args.tracks,
+        "speed": args.speed,
+        "ffmpeg": args.ffmpeg,
+        "wall_seconds": wall,
+        "audio_seconds": audio_seconds,
+        "cpu_seconds": cpu,
+        # Cores one real time stream costs
+        "cpu_per_stream": cpu / audio_seconds if audio_seconds else None,
+        "download_bytes": yt_metrics.DOWNLOAD_BYTES.sum,
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "first_audio_seconds": _summary(first_audio),
+        "track_gap_seconds": _summary(gaps),
+        "loop_lag_seconds": _summary(loop_lag),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--tracks", type=int, default=5, help="Tracks queued per guild")
+    parser.add_argument("--track-seconds", type=float, default=5.0)
+    parser.add_argument("--speed", type=float, default=10.0, help="Playback speed, 1 is real time and needed to measure prewarmed track gaps")
+    parser.add_argument("--extract-ms", type=float, default=50)
+    parser.add_argument("--download-ms", type=float, default=200)
+    parser.add_argument("--connect-ms", type=float, default=100)
+    parser.add_argument("--source-startup-ms", type=float, default=150, help="Stand-in for FFmpeg startup")
+    parser.add_argument("--skip-rate", type=float, default=0.2, help="Chance of a skip per check")
+    parser.add_argument("--stop-rate", type=float, default=0.1, help="Share of guilds stopped halfway")
+    parser.add_argument("--ffmpeg", action="store_true", help="Generate real Opus files and play through FFmpeg")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    FakeYoutubeDL.extract_seconds = args.extract_ms / 1000
+    FakeYoutubeDL.download_seconds = args.download_ms / 1000
+    FakeYoutubeDL.track_seconds = args.track_seconds
+    FakeYoutubeDL.use_ffmpeg = args.ffmpeg
+    FakeVoiceClient.speed = args.speed
+    FakeVoiceClient.connect_seconds = args.connect_ms / 1000
+    FrameFileSource.startup_seconds = args.source_startup_ms / 1000
+    yt_dlp.YoutubeDL = FakeYoutubeDL
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # Settings are read from env when first used, set them before importing ytdb
+        os.environ["YTDB_CACHE_DIR"] = cache_dir
+        os.environ["YTDB_EXTRACT_BACKEND"] = "thread"
+        os.environ.pop("YTDB_METADATA_DB", None)
+        os.environ.setdefault("YTDB_PLAYBACK_MODE", "download")
+        # The bot's own logging goes to stderr so stdout is just the result
+        with contextlib.redirect_stdout(sys.stderr):
+            result = asyncio.run(run_async(args))
+            from ytdb.yt_cache import get_cache
+
+            # The atexit flush would run after cache_dir is gone
+            get_cache().flush()
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
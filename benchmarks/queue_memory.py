@@ -0,0 +1,81 @@
+"""Queue Memory Benchmark
+    - Measures memory held per queued track with tracemalloc
+    - python -m benchmarks.queue_memory --guilds 1000 --tracks 10000
+
+"""
+import gc
+import json
+import argparse
+import tracemalloc
+from types import SimpleNamespace
+
+from ytdb.yt_player import YoutubeDiscordPlayer
+
+
+def fake_download_data(index: int) -> dict:
+    """Track metadata shaped like what resolve() returns"""
+    video_id = f"{index:011d}"
+    return {
+        "id": video_id,
+        "file": None,
+        "title": f"Some Artist - Some Fairly Long Song Title (Official Video) #{index}",
+        "url": f"https://www.youtube.com/watch?v={video_id}",
+        "thumbnail": f"https://i.ytimg.com/vi/{video_id}/maxresdefault.jpg",
+        "duration": "3:45",
+        "duration_seconds": 225,
+        "uploader": "Some Artist",
+        "acodec": "opus",
+        "ext": "webm",
+    }
+
+
+def run(guilds: int, tracks: int) -> dict:
+    # Discord objects live in the bot cache anyway, create them before measuring
+    channels = [
+        SimpleNamespace(id=10_000 + g, guild=SimpleNamespace(id=g)) for g in range(guilds)
+    ]
+    contexts = [
+        SimpleNamespace(author=SimpleNamespace(id=20_000 + g), channel=SimpleNamespace(id=30_000 + g))
+        for g in range(guilds)
+    ]
+    download_data = [fake_download_data(i) for i in range(tracks)]
+    players = [
+        YoutubeDiscordPlayer(None, guild_id=g, prefetch_depth=-1) for g in range(guilds)
+    ]
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+
+    for i in range(tracks):
+        g = i % guilds
+        players[g].add(
+            download_data[i]["url"], channels[g], download_data[i], context=contexts[g]
+        )
+
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return {
+        "benchmark": "queue_memory",
+        "guilds": guilds,
+        "tracks": tracks,
+        "bytes_total": total,
+        "bytes_per_entry": total / tracks,
+        "peak_bytes": peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--tracks", type=int, default=10000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.guilds, args.tracks)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Track Index Benchmark
+    - Measures search latency of the /p autocomplete index as it grows, with
+      plays and newly resolved tracks between searches
+    - python -m benchmarks.track_index --tracks 50000 --queries 2000
+
+"""
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+from ytdb.yt_index import TrackIndex
+
+
+def fake_vocabulary(rng: random.Random, size: int) -> list:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choices(letters, k=rng.randint(3, 9))) for _ in range(size)]
+
+
+def _percentile(samples: list, q: float) -> float:
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def run(tracks: int, queries: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    words = fake_vocabulary(rng, 20000)
+    artists = [" ".join(rng.choices(words, k=2)) for _ in range(tracks // 10 + 1)]
+
+    docs = [
+        {
+            "id": f"{i:011d}",
+            "title": " ".join(rng.choices(words, k=rng.randint(2, 6))),
+            "uploader": rng.choice(artists),
+        }
+        for i in range(tracks)
+    ]
+    plays = [rng.randint(0, 50) for _ in range(tracks)]
+
+    def build() -> TrackIndex:
+        index = TrackIndex(max_tracks=tracks)
+        for data, count in zip(docs, plays):
+            index.add(data, plays=count)
+        return index
+
+    started = time.perf_counter()
+    index = build()
+    build_seconds = time.perf_counter() - started
+
+    # Built again for memory, tracemalloc slows the build down a lot
+    tracemalloc.start()
+    rebuilt = build()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del rebuilt
+
+    # What someone typing sees: one or two words, the last one unfinished.
+    # Tracks start and new ones get resolved between keystrokes
+    samples = []
+    for i in range(queries):
+        index.played(rng.choice(docs)["id"])
+        if i % 4 == 0:
+            index.add(
+                {
+                    "id": f"n{i:010d}",
+                    "title": " ".join(rng.choices(words, k=rng.randint(2, 6))),
+                    "uploader": rng.choice(artists),
+                }
+            )
+        typed = rng.sample(words, rng.randint(1, 2))
+        typed[-1] = typed[-1][: rng.randint(1, len(typed[-1]))]
+        query = " ".join(typed)
+        started = time.perf_counter()
+        index.search(query)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+
+    return {
+        "benchmark": "track_index",
+        "tracks": tracks,
+        "queries": queries,
+        "build_seconds": build_seconds,
+        "bytes_per_track": memory / tracks,
+        "search_ms_p50": _percentile(samples, 0.5) * 1000,
+        "search_ms_p99": _percentile(samples, 0.99) * 1000,
+        "search_ms_max": samples[-1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tracks", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    print(json.dumps(run(args.tracks, args.queries, args.seed)))
+
+
+if __name__ == "__main__":
+    main()
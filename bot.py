@@ -1,17 +1,20 @@
 """Main Bot Start Script
 """
-import os
+import time
+
+# Taken before the heavy imports so the startup report covers them
+STARTED = time.perf_counter()
 
-import asyncio
+import os
 import json
 from dotenv import load_dotenv
 import discord
 from discord.ext import commands
-from ytdb.yt_player import YoutubeCommands
 
 
 def main():
     """Main"""
+    timings = {"imports": time.perf_counter() - STARTED}
     print("Starting YTDB...")
 
     # Get envs
@@ -25,6 +28,32 @@ def main():
     command_prefix = json.loads(os.getenv("COMMAND_PREFIX", '["!steve "]'))
     print("command_prefix(es): {command_prefix}".format(command_prefix=command_prefix))
 
+    # Sharding: SHARD_COUNT="auto" lets Discord pick, a number fixes the total.
+    # SHARD_IDS (JSON list) limits this process to some of the shards, so
+    # several processes can split one bot between them
+    shard_count = os.getenv("SHARD_COUNT")
+    shard_ids = json.loads(os.getenv("SHARD_IDS", "null"))
+    sharded = shard_count is not None or shard_ids is not None
+    if shard_count == "auto":
+        shard_count = None
+    elif shard_count is not None:
+        shard_count = int(shard_count)
+    if shard_ids is not None:
+        # discord.py can't combine picked shards with an automatic shard count
+        if shard_count is None:
+            raise SystemExit("SHARD_IDS needs a fixed SHARD_COUNT, not auto or unset")
+        invalid = [shard_id for shard_id in shard_ids if not 0 <= shard_id < shard_count]
+        if invalid:
+            raise SystemExit(
+                "SHARD_IDS {invalid} out of range for SHARD_COUNT {shard_count}".format(
+                    invalid=invalid, shard_count=shard_count
+                )
+            )
+    if sharded:
+        print("shard_count: {shard_count}, shard_ids: {shard_ids}".format(
+            shard_count=shard_count or "auto", shard_ids=shard_ids or "all"
+        ))
+
     # Create Intents for bot
     print("Creating intents...")
     intents = discord.Intents.default()
@@ -42,18 +71,46 @@ def main():
 
     # Create bot
     print("Creating main bot...")
-    main_bot = commands.Bot(
-        command_prefix=command_prefix,
-        intents=intents,
-        activity=discord.Game("huh?"),
-    )
+    if sharded:
+        main_bot = commands.AutoShardedBot(
+            command_prefix=command_prefix,
+            intents=intents,
+            activity=discord.Game("huh?"),
+            shard_count=shard_count,
+            shard_ids=shard_ids,
+        )
+    else:
+        main_bot = commands.Bot(
+            command_prefix=command_prefix,
+            intents=intents,
+            activity=discord.Game("huh?"),
+        )
+
+    async def setup_hook():
+        """Runs once after login, on the bot's own loop"""
+        timings["login"] = time.perf_counter() - STARTED
+        await main_bot.load_extension("ytdb.yt_player")
+        timings["extensions"] = time.perf_counter() - STARTED
+
+    main_bot.setup_hook = setup_hook
 
     @main_bot.event
     async def on_ready():
         """On Ready for bot"""
         print(f"{main_bot.user} has connected to Discord!")
+        if "ready" not in timings:
+            timings["ready"] = time.perf_counter() - STARTED
+            print(
+                "Startup (seconds since launch): imports {imports:.2f}, logged in {login:.2f}, "
+                "extensions loaded {extensions:.2f}, ready {ready:.2f}".format(**timings)
+            )
+
+    @main_bot.event
+    async def on_shard_ready(shard_id):
+        """On Ready for each shard"""
+        guilds = sum(1 for guild in main_bot.guilds if guild.shard_id == shard_id)
+        print(f"Shard {shard_id} ready with {guilds} guilds")
 
-    asyncio.run(main_bot.load_extension("ytdb.yt_player"))
     main_bot.run(token)
 
 
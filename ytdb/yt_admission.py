@@ -0,0 +1,179 @@
+"""Youtube Admission Control
+    - Per user and per guild token buckets on play requests
+    - Queue length and track duration limits
+    - Rejections are counted per reason on the metrics endpoint
+
+"""
+import os
+import math
+import time
+from .yt_metrics import PLAY_REJECTED
+
+
+class RateLimiter:
+    """Token bucket per key
+
+    Buckets start full. A key's bucket is dropped once it has refilled, so
+    only recently active keys take memory.
+
+    Arguments:
+        per_minute (float): Tokens added per minute
+        burst (int): Bucket size, requests allowed at once
+        max_keys (int): Buckets kept before full ones are dropped
+    """
+
+    def __init__(self, per_minute: float, burst: int, max_keys: int = 10000):
+        self.rate = per_minute / 60
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._sweep_at = max_keys
+
+    def _tokens(self, key, now: float) -> float:
+        entry = self._buckets.get(key)
+        if entry is None:
+            return self.burst
+        tokens, updated = entry
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def retry_after(self, key, now: float) -> float:
+        """Seconds until key has a token, 0 if it has one now"""
+        tokens = self._tokens(key, now)
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) / self.rate
+
+    def take(self, key, now: float):
+        """Takes a token from key's bucket, check retry_after() first"""
+        self._buckets[key] = (self._tokens(key, now) - 1, now)
+        if len(self._buckets) > self._sweep_at:
+            self._sweep(now)
+
+    def refund(self, key, now: float):
+        """Gives back a token taken with take()"""
+        if key in self._buckets:
+            self._buckets[key] = (min(self.burst, self._tokens(key, now) + 1), now)
+
+    def _sweep(self, now: float):
+        full = [key for key in self._buckets if self._tokens(key, now) >= self.burst]
+        for key in full:
+            del self._buckets[key]
+        # Don't sweep again on every take when most buckets are in use
+        self._sweep_at = max(self.max_keys, 2 * len(self._buckets))
+
+
+class Admission:
+    """Decides whether a play request is queued
+
+    check() runs before any yt-dlp work and takes the tokens up front, so
+    concurrent requests can't all slip through. Requests that end up
+    queueing nothing (no voice channel, a url that fails to resolve, a
+    track that is too long) hand them back with refund(). Rejected requests
+    take nothing, so spamming past the limit doesn't push the next allowed
+    request further out. Limits of 0 are off.
+
+    Arguments:
+        user_per_minute (float): Plays a user can request per minute
+        user_burst (int): Plays a user can request at once
+        guild_per_minute (float): Plays a guild can request per minute
+        guild_burst (int): Plays a guild can request at once
+        max_queue (int): Most tracks queued per guild
+        max_track_seconds (int): Longest track accepted
+    """
+
+    def __init__(
+        self,
+        user_per_minute: float = 10,
+        user_burst: int = 5,
+        guild_per_minute: float = 30,
+        guild_burst: int = 20,
+        max_queue: int = 500,
+        max_track_seconds: int = 0,
+    ):
+        self.users = RateLimiter(user_per_minute, user_burst) if user_per_minute > 0 else None
+        self.guilds = RateLimiter(guild_per_minute, guild_burst) if guild_per_minute > 0 else None
+        self.max_queue = max_queue
+        self.max_track_seconds = max_track_seconds
+
+    def _reject(self, reason: str, message: str) -> str:
+        PLAY_REJECTED.inc(reason)
+        return message
+
+    def _limits(self, guild_id, user_id):
+        return (
+            ("user_rate", self.users, user_id, "You are"),
+            ("guild_rate", self.guilds, guild_id, "This server is"),
+        )
+
+    def check(self, guild_id, user_id, queued: int) -> str:
+        """Admits a play request. Returns why it was rejected, None if admitted
+
+        Arguments:
+            guild_id (int): Guild the track would be queued in
+            user_id (int): Who asked
+            queued (int): Tracks in the guild's queue now
+        """
+        if self.max_queue and queued >= self.max_queue:
+            return self._reject("queue_full", f"The queue is full ({self.max_queue} tracks)")
+
+        now = time.monotonic()
+        for reason, limiter, key, who in self._limits(guild_id, user_id):
+            if limiter is None:
+                continue
+            wait = limiter.retry_after(key, now)
+            if wait > 0:
+                return self._reject(
+                    reason, f"{who} adding tracks too fast, try again in {math.ceil(wait)}s"
+                )
+        for reason, limiter, key, who in self._limits(guild_id, user_id):
+            if limiter is not None:
+                limiter.take(key, now)
+        return None
+
+    def refund(self, guild_id, user_id):
+        """Gives back the tokens of an admitted request that queued nothing"""
+        now = time.monotonic()
+        for reason, limiter, key, who in self._limits(guild_id, user_id):
+            if limiter is not None:
+                limiter.refund(key, now)
+
+    def check_duration(self, download_data: dict) -> str:
+        """Rejects tracks over max_track_seconds. Live streams have no duration and pass"""
+        duration = download_data.get("duration_seconds")
+        if self.max_track_seconds and duration and duration > self.max_track_seconds:
+            return self._reject(
+                "too_long",
+                f"**{download_data.get('title')}** is longer than {self.max_track_seconds // 60} minutes",
+            )
+        return None
+
+    def queue_room(self, queued: int) -> int:
+        """Tracks that can still be added to a queue of queued tracks"""
+        if not self.max_queue:
+            return math.inf
+        return max(0, self.max_queue - queued)
+
+    async def filter_batches(self, batches):
+        """Drops tracks rejected by check_duration() from batches of download_data"""
+        async for batch in batches:
+            batch = [download_data for download_data in batch if self.check_duration(download_data) is None]
+            if batch:
+                yield batch
+
+
+_admission = None
+
+
+def get_admission() -> Admission:
+    """Returns the process wide admission control, configured from env on first use"""
+    global _admission
+    if _admission is None:
+        _admission = Admission(
+            user_per_minute=float(os.getenv("YTDB_USER_PLAYS_PER_MINUTE", "10")),
+            user_burst=int(os.getenv("YTDB_USER_PLAYS_BURST", "5")),
+            guild_per_minute=float(os.getenv("YTDB_GUILD_PLAYS_PER_MINUTE", "30")),
+            guild_burst=int(os.getenv("YTDB_GUILD_PLAYS_BURST", "20")),
+            max_queue=int(os.getenv("YTDB_MAX_QUEUE", "500")),
+            max_track_seconds=int(os.getenv("YTDB_MAX_TRACK_SECONDS", "0")),
+        )
+    return _admission
@@ -0,0 +1,234 @@
+"""Youtube Audio Cache
+    - Keeps downloaded audio on disk keyed by video id and format
+    - Evicts least recently used files once the cache goes over its byte budget
+
+"""
+import os
+import json
+import time
+import atexit
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+
+DEFAULT_CACHE_DIR = "cache"
+DEFAULT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2 GiB
+INDEX_FILENAME = "index.json"
+INDEX_SAVE_INTERVAL = 5.0
+
+
+def format_key(format_selector: str) -> str:
+    """Short stable key for a yt-dlp format selector, used in cache filenames"""
+    return hashlib.sha1(format_selector.encode("utf-8")).hexdigest()[:10]
+
+
+class AudioCache:
+    """Size bounded LRU cache of downloaded audio files
+
+    Entries are keyed by ``<video id>.<format key>`` and kept least recently
+    used first, so eviction doesn't sort. The index is stored as json next
+    to the files so the cache survives restarts. Changes are written at
+    most every save_interval seconds on a thread, call flush() to write
+    now. Files that are pinned (queued or playing) are never evicted.
+
+    Arguments:
+        directory (str): Where the files and the index live
+        max_bytes (int): Byte budget
+        save_interval (float): Seconds index changes may wait before being written
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_CACHE_DIR,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+        save_interval: float = INDEX_SAVE_INTERVAL,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.save_interval = save_interval
+        self.index_path = os.path.join(directory, INDEX_FILENAME)
+        self.entries = OrderedDict()
+        self.pins = {}
+        self.total_bytes = 0
+        # Reentrant, _save() may flush right away while the lock is held
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._version = 0
+        self._written_version = 0
+        self._save_handle = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(video_id: str, fmt_key: str) -> str:
+        """Cache key for a video id and format key"""
+        return f"{video_id}.{fmt_key}"
+
+    def _load(self):
+        """Loads the index from disk, dropping entries whose files are gone"""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            entries = {}
+        except (OSError, ValueError) as ex:
+            print(f"Cache index unreadable, starting empty: {ex}")
+            entries = {}
+
+        for key, entry in sorted(entries.items(), key=lambda kv: kv[1]["last_access"]):
+            if os.path.exists(entry["file"]):
+                self.entries[key] = entry
+                self.total_bytes += entry["size"]
+        self._evict()
+
+    def _save(self):
+        """Schedules an index write, batching the changes of the next save_interval seconds"""
+        self._version += 1
+        if self._save_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (scripts), nothing to stall
+            self.flush()
+            return
+        self._save_handle = loop.call_later(self.save_interval, self._save_in_thread, loop)
+
+    def _save_in_thread(self, loop):
+        self._save_handle = None
+        with self._lock:
+            snapshot = (self._version, dict(self.entries))
+        loop.run_in_executor(None, self._write, *snapshot)
+
+    def flush(self):
+        """Writes pending index changes now"""
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        with self._lock:
+            snapshot = (self._version, dict(self.entries))
+        self._write(*snapshot)
+
+    def _write(self, version: int, entries: dict):
+        """Atomically writes entries to the index file, unless a newer version was written"""
+        with self._write_lock:
+            if version <= self._written_version:
+                return
+            tmp_path = self.index_path + ".tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, self.index_path)
+            except (OSError, ValueError) as ex:
+                print(f"Cache index write failed: {ex}")
+                return
+            self._written_version = version
+
+    def get(self, key: str):
+        """Returns cached download data for key or None. Marks the entry as used"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if not os.path.exists(entry["file"]):
+                self._drop(key)
+                self._save()
+                return None
+            # Access times are flushed with the next put/unpin to keep hits cheap
+            entry["last_access"] = time.time()
+            entry["hits"] += 1
+            self.entries.move_to_end(key)
+            return dict(entry["data"], file=entry["file"])
+
+    def put(self, key: str, data: dict):
+        """Adds a freshly downloaded file to the cache and evicts if over budget"""
+        file = data["file"]
+        try:
+            size = os.path.getsize(file)
+        except OSError:
+            return
+        with self._lock:
+            if key in self.entries:
+                self._drop(key, remove_file=False)
+            self.entries[key] = {
+                "file": file,
+                "size": size,
+                "last_access": time.time(),
+                "hits": 0,
+                "data": {k: v for k, v in data.items() if k != "file"},
+            }
+            self.total_bytes += size
+            self._evict()
+            self._save()
+
+    def pin(self, file: str):
+        """Protects file from eviction while it is queued or playing"""
+        with self._lock:
+            self.pins[file] = self.pins.get(file, 0) + 1
+
+    def unpin(self, file: str):
+        """Releases a pin taken with pin() and evicts if over budget"""
+        with self._lock:
+            count = self.pins.get(file, 0) - 1
+            if count > 0:
+                self.pins[file] = count
+            else:
+                self.pins.pop(file, None)
+            self._evict()
+            self._save()
+
+    def _drop(self, key: str, remove_file: bool = True):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry["size"]
+        if remove_file:
+            try:
+                os.remove(entry["file"])
+            except OSError:
+                pass
+
+    def _evict(self) -> bool:
+        """Removes least recently used unpinned files until under budget"""
+        excess = self.total_bytes - self.max_bytes
+        if excess <= 0:
+            return False
+        victims = []
+        for key, entry in self.entries.items():
+            if excess <= 0:
+                break
+            if entry["file"] not in self.pins:
+                victims.append(key)
+                excess -= entry["size"]
+        for key in victims:
+            self._drop(key)
+        return bool(victims)
+
+
+def cache_dir() -> str:
+    """Configured cache directory"""
+    return os.getenv("YTDB_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+
+def outtmpl(fmt_key: str) -> str:
+    """yt-dlp output template that writes into the cache directory
+
+    Doesn't touch the index, so worker processes can use it without loading
+    (and evicting from) their own copy of the cache.
+    """
+    return os.path.join(cache_dir(), f"%(id)s.{fmt_key}.%(ext)s")
+
+
+_cache = None
+
+
+def get_cache() -> AudioCache:
+    """Returns the process wide audio cache, configured from env on first use"""
+    global _cache
+    if _cache is None:
+        _cache = AudioCache(
+            directory=cache_dir(),
+            max_bytes=int(os.getenv("YTDB_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES)),
+        )
+        atexit.register(_cache.flush)
+    return _cache
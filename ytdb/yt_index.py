@@ -0,0 +1,208 @@
+"""Youtube Track Index
+    - In-memory index of every track the bot has resolved
+    - Word prefix search ranked by play count, fast enough for autocomplete
+
+"""
+import os
+import re
+import heapq
+import bisect
+from collections import OrderedDict
+from .yt_cache import get_cache
+from .yt_metadata import get_metadata_cache
+
+DEFAULT_MAX_TRACKS = 50000
+# A prefix matching over 1/WIDE_PREFIX_SHARE of the tracks is checked track by track
+WIDE_PREFIX_SHARE = 16
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _words(text: str) -> list:
+    return _WORD_RE.findall(text.lower())
+
+
+class _Track:
+    __slots__ = ("title", "uploader", "plays", "words")
+
+    def __init__(self, title, uploader, plays, words):
+        self.title = title
+        self.uploader = uploader
+        self.plays = plays
+        self.words = words
+
+
+class TrackIndex:
+    """Searchable index of resolved tracks
+
+    Every word of a track's title and uploader maps to the set of track ids
+    containing it, and the words are kept sorted so a prefix finds its
+    words with a binary search. A query matches tracks that have a word
+    starting with each query word, best played first. Least recently
+    resolved or played tracks are dropped past max_tracks.
+
+    Arguments:
+        max_tracks (int): Most tracks kept
+    """
+
+    def __init__(self, max_tracks: int = DEFAULT_MAX_TRACKS):
+        self.max_tracks = max_tracks
+        self._tracks = OrderedDict()
+        self._words = {}
+        self._vocab = []
+        # Play count -> ids with that count, and the counts in use sorted, so
+        # the popularity order is kept up to date without sorting
+        self._by_plays = {}
+        self._play_counts = []
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def add(self, data: dict, plays: int = 0):
+        """Adds or refreshes a track from download data"""
+        video_id = data.get("id")
+        if not video_id or not data.get("title"):
+            return
+        track = self._tracks.get(video_id)
+        if track is not None:
+            self._tracks.move_to_end(video_id)
+            if plays > track.plays:
+                self._set_plays(video_id, track, plays)
+            return
+
+        uploader = data.get("uploader") or ""
+        words = tuple(set(_words(f"{data['title']} {uploader}")))
+        self._tracks[video_id] = _Track(data["title"], uploader, plays, words)
+        for word in words:
+            ids = self._words.get(word)
+            if ids is None:
+                ids = self._words[word] = set()
+                bisect.insort(self._vocab, word)
+            ids.add(video_id)
+        self._rank(video_id, plays)
+        while len(self._tracks) > self.max_tracks:
+            self._drop(next(iter(self._tracks)))
+
+    def _drop(self, video_id: str):
+        track = self._tracks.pop(video_id)
+        for word in track.words:
+            ids = self._words[word]
+            ids.discard(video_id)
+            if not ids:
+                del self._words[word]
+                del self._vocab[bisect.bisect_left(self._vocab, word)]
+        self._unrank(video_id, track.plays)
+
+    def played(self, video_id: str):
+        """Counts a play of an indexed track"""
+        track = self._tracks.get(video_id)
+        if track is not None:
+            self._set_plays(video_id, track, track.plays + 1)
+            self._tracks.move_to_end(video_id)
+
+    def _rank(self, video_id: str, plays: int):
+        ids = self._by_plays.get(plays)
+        if ids is None:
+            ids = self._by_plays[plays] = {}
+            bisect.insort(self._play_counts, plays)
+        ids[video_id] = None
+
+    def _unrank(self, video_id: str, plays: int):
+        ids = self._by_plays[plays]
+        del ids[video_id]
+        if not ids:
+            del self._by_plays[plays]
+            del self._play_counts[bisect.bisect_left(self._play_counts, plays)]
+
+    def _set_plays(self, video_id: str, track, plays: int):
+        self._unrank(video_id, track.plays)
+        track.plays = plays
+        self._rank(video_id, plays)
+
+    def _prefix_words(self, prefix: str) -> list:
+        """Indexed words starting with prefix"""
+        start = bisect.bisect_left(self._vocab, prefix)
+        end = bisect.bisect_left(self._vocab, prefix + "\uffff", start)
+        return self._vocab[start:end]
+
+    def _ranked(self):
+        """Yields all track ids, most played first"""
+        for plays in reversed(self._play_counts):
+            yield from self._by_plays[plays]
+
+    def _matches(self, video_id: str, word_sets) -> bool:
+        """Whether the track has a word from each of word_sets"""
+        words = self._tracks[video_id].words
+        return all(not word_set.isdisjoint(words) for word_set in word_sets)
+
+    def search(self, query: str, limit: int = 25) -> list:
+        """Best played tracks matching query, as (video id, title, uploader, plays)"""
+        narrow, wide = [], []
+        for prefix in set(_words(query)):
+            words = self._prefix_words(prefix)
+            if not words:
+                return []
+            # Short prefixes like "a" match a good part of the index, merging
+            # their id sets costs more than checking tracks in play order
+            wide_count = len(self._tracks) // WIDE_PREFIX_SHARE
+            count = 0
+            for word in words:
+                count += len(self._words[word])
+                if count > wide_count:
+                    wide.append(set(words))
+                    break
+            else:
+                narrow.append((count, words))
+
+        if not narrow:
+            found = []
+            for video_id in self._ranked():
+                if self._matches(video_id, wide):
+                    found.append(video_id)
+                    if len(found) == limit:
+                        break
+            return self._rows(found)
+
+        candidates = None
+        # Fewest matches first, they narrow the candidates the most
+        for count, words in sorted(narrow, key=lambda entry: entry[0]):
+            ids = set()
+            for word in words:
+                ids |= self._words[word]
+            candidates = ids if candidates is None else candidates & ids
+            if not candidates:
+                return []
+        if wide:
+            candidates = [video_id for video_id in candidates if self._matches(video_id, wide)]
+        tracks = self._tracks
+        return self._rows(heapq.nlargest(limit, candidates, key=lambda video_id: tracks[video_id].plays))
+
+    def _rows(self, ids) -> list:
+        tracks = self._tracks
+        return [
+            (video_id, tracks[video_id].title, tracks[video_id].uploader, tracks[video_id].plays)
+            for video_id in ids
+        ]
+
+
+_track_index = None
+
+
+def get_track_index() -> TrackIndex:
+    """Returns the process wide track index, configured from env on first use
+
+    Starts out with the tracks the metadata cache knows, ranked by how often
+    the audio cache served them.
+    """
+    global _track_index
+    if _track_index is None:
+        _track_index = TrackIndex(
+            max_tracks=int(os.getenv("YTDB_INDEX_MAX_TRACKS", DEFAULT_MAX_TRACKS))
+        )
+        plays = {}
+        for entry in get_cache().entries.values():
+            video_id = entry["data"].get("id")
+            plays[video_id] = plays.get(video_id, 0) + entry["hits"]
+        for data in get_metadata_cache().tracks():
+            _track_index.add(data, plays.get(data["id"], 0))
+    return _track_index
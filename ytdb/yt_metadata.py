@@ -0,0 +1,256 @@
+"""Youtube Metadata Cache
+    - Remembers what urls and search strings resolved to, so repeat plays
+      skip extract_info
+    - In-process LRU with TTL, optionally backed by SQLite to survive restarts
+
+"""
+import os
+import json
+import time
+import atexit
+import asyncio
+import sqlite3
+from collections import OrderedDict
+
+DEFAULT_TTL = 6 * 3600
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+
+class MetadataCache:
+    """LRU + TTL cache of resolved track metadata
+
+    Tracks are stored under ``id:<video id>``. Other lookup keys (search
+    queries) are aliases pointing at a track key. Entries hold the fields
+    download() returns minus "file"; streamed entries also carry their
+    direct url, which is only handed out while it hasn't expired.
+
+    Writes to SQLite are batched into one commit every flush_interval
+    seconds, call flush() to write now.
+
+    Arguments:
+        max_entries (int): Size of the in-process LRU
+        ttl (float): Seconds metadata stays valid
+        db_path (str): Optional SQLite file backing the LRU
+        flush_interval (float): Seconds db writes may wait to be batched
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl: float = DEFAULT_TTL,
+        db_path: str = None,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+        self._entries = OrderedDict()
+        self._aliases = OrderedDict()
+        self._db = None
+        self._pending_tracks = {}
+        self._pending_aliases = {}
+        self._flush_handle = None
+        if db_path:
+            self._db = sqlite3.connect(db_path)
+            # Commits don't wait for an fsync, a crash only loses the last few entries
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tracks (key TEXT PRIMARY KEY, data TEXT, expires REAL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS aliases (key TEXT PRIMARY KEY, track_key TEXT)"
+            )
+            self._db.execute("DELETE FROM tracks WHERE expires < ?", (time.time(),))
+            self._db.commit()
+
+    @staticmethod
+    def track_key(video_id: str) -> str:
+        return f"id:{video_id}"
+
+    @staticmethod
+    def query_key(query: str) -> str:
+        return "q:" + " ".join(query.lower().split())
+
+    def get(self, key: str, stream_margin: float = None, stream_format: str = None):
+        """Returns cached metadata for key or None
+
+        Arguments:
+            key (str): track_key() or query_key()
+            stream_margin (float): If set, only return entries whose stream url
+                is valid for at least this many more seconds
+            stream_format (str): If set, only return entries whose stream url
+                was resolved for this format key
+        """
+        started = time.perf_counter()
+        data = self._lookup(key)
+        if data is not None and stream_margin is not None:
+            expires = data.get("stream_expires")
+            if expires is None or expires - stream_margin <= time.time():
+                data = None
+        if data is not None and stream_format is not None and data.get("stream_format") != stream_format:
+            data = None
+
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            data = dict(data)
+        self.lookup_seconds += time.perf_counter() - started
+        return data
+
+    def _lookup(self, key: str):
+        track_key = self._resolve_alias(key)
+        if track_key is None:
+            return None
+
+        now = time.time()
+        entry = self._entries.get(track_key)
+        if entry is None and track_key in self._pending_tracks:
+            entry = self._pending_tracks[track_key]
+            self._remember(track_key, entry)
+        if entry is None and self._db is not None:
+            row = self._db.execute(
+                "SELECT data, expires FROM tracks WHERE key = ?", (track_key,)
+            ).fetchone()
+            if row is not None:
+                entry = (row[1], json.loads(row[0]))
+                self._remember(track_key, entry)
+        if entry is None:
+            return None
+
+        expires, data = entry
+        if expires <= now:
+            self._entries.pop(track_key, None)
+            return None
+        self._entries.move_to_end(track_key)
+        return data
+
+    def _resolve_alias(self, key: str):
+        if key.startswith("id:"):
+            return key
+        track_key = self._aliases.get(key)
+        if track_key is None and key in self._pending_aliases:
+            track_key = self._pending_aliases[key]
+            self._remember_alias(key, track_key)
+        if track_key is None and self._db is not None:
+            row = self._db.execute(
+                "SELECT track_key FROM aliases WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                track_key = row[0]
+                self._remember_alias(key, track_key)
+        if track_key is not None:
+            self._aliases.move_to_end(key)
+        return track_key
+
+    def put(self, key: str, data: dict):
+        """Stores metadata returned for lookup key
+
+        Stream fields of an existing entry are kept if data has none.
+        """
+        track_key = self.track_key(data["id"])
+        data = {k: v for k, v in data.items() if k != "file"}
+        existing = self._lookup(track_key)
+        if existing is not None and "stream_url" not in data and "stream_url" in existing:
+            for field in ("stream_url", "stream_expires", "stream_before_options", "stream_format"):
+                if field in existing:
+                    data[field] = existing[field]
+
+        entry = (time.time() + self.ttl, data)
+        self._remember(track_key, entry)
+        if key != track_key:
+            self._remember_alias(key, track_key)
+
+        if self._db is not None:
+            self._pending_tracks[track_key] = entry
+            if key != track_key:
+                self._pending_aliases[key] = track_key
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (scripts), nothing to stall
+            self.flush()
+            return
+        self._flush_handle = loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        """Writes pending entries to the db in one transaction"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._db is None or not (self._pending_tracks or self._pending_aliases):
+            return
+        tracks, self._pending_tracks = self._pending_tracks, {}
+        aliases, self._pending_aliases = self._pending_aliases, {}
+        self._db.executemany(
+            "INSERT OR REPLACE INTO tracks VALUES (?, ?, ?)",
+            [(track_key, json.dumps(data), expires) for track_key, (expires, data) in tracks.items()],
+        )
+        self._db.executemany("INSERT OR REPLACE INTO aliases VALUES (?, ?)", list(aliases.items()))
+        self._db.commit()
+
+    def _remember(self, track_key: str, entry):
+        self._entries[track_key] = entry
+        self._entries.move_to_end(track_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _remember_alias(self, key: str, track_key: str):
+        self._aliases[key] = track_key
+        self._aliases.move_to_end(key)
+        while len(self._aliases) > self.max_entries:
+            self._aliases.popitem(last=False)
+
+    def tracks(self):
+        """Yields the metadata of every unexpired track, in memory or in the db"""
+        self.flush()
+        now = time.time()
+        seen = set()
+        for track_key, (expires, data) in list(self._entries.items()):
+            if expires > now:
+                seen.add(track_key)
+                yield data
+        if self._db is not None:
+            rows = self._db.execute(
+                "SELECT key, data FROM tracks WHERE expires > ?", (now,)
+            ).fetchall()
+            for track_key, data in rows:
+                if track_key not in seen:
+                    yield json.loads(data)
+
+    def stats(self) -> dict:
+        """Hit rate and average lookup latency since start"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "avg_lookup_us": self.lookup_seconds / lookups * 1e6 if lookups else 0.0,
+        }
+
+
+_metadata_cache = None
+
+
+def get_metadata_cache() -> MetadataCache:
+    """Returns the process wide metadata cache, configured from env on first use"""
+    global _metadata_cache
+    if _metadata_cache is None:
+        _metadata_cache = MetadataCache(
+            max_entries=int(os.getenv("YTDB_METADATA_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            ttl=float(os.getenv("YTDB_METADATA_TTL", DEFAULT_TTL)),
+            db_path=os.getenv("YTDB_METADATA_DB"),
+        )
+        atexit.register(_metadata_cache.flush)
+    return _metadata_cache
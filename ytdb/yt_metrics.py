@@ -0,0 +1,290 @@
+"""Youtube Metrics
+    - Histograms, gauges and counters for the playback pipeline
+    - Served in Prometheus text format on a local HTTP endpoint
+    - Event loop lag monitor
+
+"""
+import os
+import time
+import asyncio
+from aiohttp import web
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BYTES_BUCKETS = (256 * 1024, 1024**2, 4 * 1024**2, 16 * 1024**2, 64 * 1024**2, 256 * 1024**2)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+_registry = []
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Histogram:
+    """Cumulative histogram without labels
+
+    Arguments:
+        name (str): Metric name
+        help (str): Description shown by Prometheus
+        buckets (tuple): Upper bounds, +Inf is added
+    """
+
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+        _registry.append(self)
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        """Context manager observing the seconds its block took"""
+        return _Timer(self)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format_value(self.sum)}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Gauge:
+    """Gauge read from a callback when scraped
+
+    The callback returns a number, or a list of (labels dict, value) pairs.
+    Nothing is set from the hot path.
+
+    Arguments:
+        name (str): Metric name
+        help (str): Description shown by Prometheus
+        collect: Callable returning the current value(s), None until set_collect()
+    """
+
+    def __init__(self, name: str, help: str, collect=None):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        _registry.append(self)
+
+    def set_collect(self, collect):
+        self.collect = collect
+
+    def render(self) -> list:
+        if self.collect is None:
+            return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.collect()
+        except Exception as ex:
+            print(f"metrics: collecting {self.name} failed: {ex}")
+            return []
+        if not isinstance(values, list):
+            values = [({}, values)]
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter:
+    """Counter, optionally split by label values
+
+    Counted with inc(), or read from a callback when scraped for counts an
+    object already keeps (see set_collect()).
+
+    Arguments:
+        name (str): Metric name, ending in _total
+        help (str): Description shown by Prometheus
+        labels (tuple): Label names, inc() takes their values in this order
+    """
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.collect = None
+        _registry.append(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def set_collect(self, collect):
+        """Reads the count from collect() instead, a callable returning a number"""
+        self.collect = collect
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        if self.collect is not None:
+            try:
+                lines.append(f"{self.name} {_format_value(self.collect())}")
+            except Exception as ex:
+                print(f"metrics: collecting {self.name} failed: {ex}")
+                return []
+            return lines
+        for label_values, value in self.values.items():
+            labels = dict(zip(self.labels, label_values))
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+EXTRACT_SECONDS = Histogram(
+    "ytdb_extract_seconds", "Metadata extraction latency, including time queued for a worker"
+)
+DOWNLOAD_SECONDS = Histogram(
+    "ytdb_download_seconds", "Audio download duration, including time queued for a worker",
+    DURATION_BUCKETS,
+)
+DOWNLOAD_BYTES = Histogram("ytdb_download_bytes", "Size of downloaded audio files", BYTES_BUCKETS)
+FIRST_AUDIO_SECONDS = Histogram(
+    "ytdb_first_audio_seconds", "Time from a play command on an idle player to its first audio packet"
+)
+TRACK_GAP_SECONDS = Histogram(
+    "ytdb_track_gap_seconds", "Silence between the end of one track and the first packet of the next"
+)
+VOICE_CONNECT_SECONDS = Histogram(
+    "ytdb_voice_connect_seconds", "Time to connect or move to a voice channel"
+)
+LOOP_LAG_SECONDS = Histogram(
+    "ytdb_event_loop_lag_seconds", "How late the event loop ran a timer", LAG_BUCKETS
+)
+
+VOICE_CLIENTS = Gauge("ytdb_voice_clients", "Connected voice clients")
+QUEUE_DEPTH = Gauge("ytdb_queue_depth", "Tracks queued per guild, only guilds with a queue")
+POOL_BUSY = Gauge("ytdb_pool_busy", "yt-dlp jobs running")
+POOL_QUEUED = Gauge("ytdb_pool_queued", "yt-dlp jobs waiting for a worker")
+POOL_SATURATION = Gauge("ytdb_pool_saturation", "Fraction of yt-dlp workers busy")
+CACHE_BYTES = Gauge("ytdb_cache_bytes", "Bytes in the audio cache")
+CACHE_FILES = Gauge("ytdb_cache_files", "Files in the audio cache")
+LOOP_LAG = Gauge("ytdb_event_loop_lag_last_seconds", "Lag of the latest event loop probe")
+
+WORKER_RESTARTS = Counter(
+    "ytdb_worker_restarts_total", "yt-dlp worker processes restarted after a crash, timeout or cancelled job"
+)
+COALESCED_REQUESTS = Counter(
+    "ytdb_coalesced_requests_total", "Extractions and downloads that joined an identical one already running"
+)
+PLAY_REJECTED = Counter(
+    "ytdb_play_rejected_total", "Play requests or playlist tracks rejected by admission control", ("reason",)
+)
+
+
+def render() -> str:
+    """All metrics in Prometheus text format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a sleep
+
+    A busy loop (blocking calls, heavy callbacks) delays every timer, so the
+    overshoot of a short sleep is the delay every command sees.
+
+    Arguments:
+        interval (float): Seconds between probes
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.last_lag = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, loop.time() - expected)
+            LOOP_LAG_SECONDS.observe(self.last_lag)
+
+
+class MetricsServer:
+    """Serves /metrics over HTTP and runs the loop lag monitor
+
+    Arguments:
+        host (str): Interface to listen on, keep it local
+        port (int): Port to listen on
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9464):
+        self.host = host
+        self.port = port
+        self.lag_monitor = LoopLagMonitor()
+        self._runner = None
+        LOOP_LAG.set_collect(lambda: self.lag_monitor.last_lag)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.lag_monitor.start()
+        print(f"metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        self.lag_monitor.stop()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+def get_metrics_server():
+    """Metrics server configured from env, None if YTDB_METRICS_PORT isn't set"""
+    port = os.getenv("YTDB_METRICS_PORT")
+    if not port:
+        return None
+    return MetricsServer(host=os.getenv("YTDB_METRICS_HOST", "127.0.0.1"), port=int(port))
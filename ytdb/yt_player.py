@@ -2,19 +2,63 @@
 """
 
 import os
+import time
 import asyncio
+from collections import deque
 import discord
 from discord.ext import commands
 from discord.ui import Button, View
-from .yt_utils import download
+from .yt_utils import (
+    download,
+    download_progressive,
+    download_finished_event,
+    resolve,
+    resolve_stream,
+    stream_is_fresh,
+    is_opus,
+    is_playlist_url,
+    iter_playlist,
+    get_service,
+    coalesced_requests,
+    quality_format_key,
+    QUALITY_TIERS,
+    warm_up,
+)
+from .yt_cache import get_cache
+from .yt_metadata import get_metadata_cache
+from .yt_queue import QueueItem, TrackQueue, trim_track
+from .yt_progressive import TailReader, DEFAULT_BUFFER_BYTES
+from .yt_snapshots import get_queue_snapshots
+from .yt_index import get_track_index
+from .yt_admission import get_admission
+from .yt_metrics import (
+    FIRST_AUDIO_SECONDS,
+    TRACK_GAP_SECONDS,
+    VOICE_CONNECT_SECONDS,
+    VOICE_CLIENTS,
+    QUEUE_DEPTH,
+    POOL_BUSY,
+    POOL_QUEUED,
+    POOL_SATURATION,
+    CACHE_BYTES,
+    CACHE_FILES,
+    get_metrics_server,
+)
+
+# Seconds a stream url has to outlive the track it plays
+STREAM_MARGIN = 60
+# discord.py sends 20ms Opus frames
+FRAME_SECONDS = 0.02
+# Frames buffered when pre-warming the next track's source
+PRIME_FRAMES = 25
 
 
 class MusicControlView(View):
     """Premium UI with interactive buttons for music control"""
     
-    def __init__(self, player, guild_id):
+    def __init__(self, find_player, guild_id):
         super().__init__(timeout=None)
-        self.player = player
+        self.find_player = find_player
         self.guild_id = guild_id
     
     # @discord.ui.button(label="⏸️ Pause", style=discord.ButtonStyle.secondary, custom_id="pause_btn")
@@ -25,135 +69,848 @@ class MusicControlView(View):
     
     @discord.ui.button(label="⏭️ Skip", style=discord.ButtonStyle.primary, custom_id="skip_btn")
     async def skip_button(self, interaction: discord.Interaction, button: Button):
-        """Skip the current track"""
-        if self.guild_id in self.player and len(self.player[self.guild_id].queue) > 0:
-            current = self.player[self.guild_id].queue[0]
-            self.player[self.guild_id].skip()
-            
-            embed = discord.Embed(title="⏭️ Skipped", color=0x00ff00)
-            embed.add_field(
-                name=current["download_data"]["title"], 
-                value=f"[Link]({current['url']})",
-                inline=False
-            )
-            await interaction.response.send_message(embed=embed, ephemeral=True)
+        """Skip the current track. The now playing message shows the result"""
+        player = self.find_player(self.guild_id)
+        if player is not None and len(player.queue) > 0:
+            player.skip()
+            await interaction.response.defer()
         else:
             await interaction.response.send_message("❌ Nothing playing!", ephemeral=True)
     
     @discord.ui.button(label="⏹️ Stop", style=discord.ButtonStyle.danger, custom_id="stop_btn")
     async def stop_button(self, interaction: discord.Interaction, button: Button):
-        """Stop playback and clear queue"""
-        if self.guild_id in self.player:
-            await self.player[self.guild_id].stop()
-            embed = discord.Embed(title="⏹️ Stopped", description="Queue cleared!", color=0xff0000)
-            await interaction.response.send_message(embed=embed, ephemeral=True)
+        """Stop playback and clear queue. The now playing message shows the result"""
+        player = self.find_player(self.guild_id)
+        if player is not None:
+            await player.stop()
+            await interaction.response.defer()
         else:
             await interaction.response.send_message("❌ Nothing playing!", ephemeral=True)
     
     @discord.ui.button(label="📋 Queue", style=discord.ButtonStyle.secondary, custom_id="queue_btn")
     async def queue_button(self, interaction: discord.Interaction, button: Button):
         """Show current queue"""
-        if self.guild_id not in self.player or len(self.player[self.guild_id].queue) == 0:
+        player = self.find_player(self.guild_id)
+        if player is None or len(player.queue) == 0:
             embed = discord.Embed(title="📋 Queue", description="No items in queue", color=0x808080)
             await interaction.response.send_message(embed=embed, ephemeral=True)
         else:
-            queue_text = ""
-            for index, item in enumerate(self.player[self.guild_id].queue[:10]):  # Show max 10
-                status = "▶️" if index == 0 else f"{index}."
-                queue_text += f"{status} **{item['download_data']['title']}**\n"
-            
-            embed = discord.Embed(title="📋 Current Queue", description=queue_text, color=0x3498db)
-            if len(self.player[self.guild_id].queue) > 10:
-                embed.set_footer(text=f"And {len(self.player[self.guild_id].queue) - 10} more...")
-            
-            await interaction.response.send_message(embed=embed, ephemeral=True)
+            view = QueuePageView(player, interaction.user)
+            await interaction.response.send_message(embed=view.render(), view=view, ephemeral=True)
+
+
+class QueuePageView(View):
+    """Single message queue display with Prev/Next buttons
+
+    Pages are rendered from the live queue on every press, only the items on
+    the shown page are touched.
+    """
+
+    def __init__(self, player, user, page_size: int = 10):
+        super().__init__(timeout=300)
+        self.player = player
+        self.user = user
+        self.page_size = page_size
+        self.page = 0
+        self._update_buttons()
+
+    @property
+    def page_count(self) -> int:
+        return max(1, -(-len(self.player.queue) // self.page_size))
+
+    def _update_buttons(self):
+        self.page = min(self.page, self.page_count - 1)
+        self.prev_button.disabled = self.page == 0
+        self.next_button.disabled = self.page >= self.page_count - 1
+
+    def render(self) -> discord.Embed:
+        """Embed for the current page"""
+        start = self.page * self.page_size
+        items = self.player.queue.page(start, self.page_size)
+        if not items:
+            embed = discord.Embed(title="📋 Queue", color=0x95a5a6)
+            embed.add_field(name="Empty", value="No items in queue")
+            return embed
+
+        lines = []
+        for index, item in enumerate(items, start=start):
+            status = "▶️" if index == 0 else f"`{index}.`"
+            title = item.download_data["title"]
+            duration = item.download_data.get("duration")
+            line = f"{status} [{title}]({item.url})"
+            if duration:
+                line += f" • {duration}"
+            lines.append(line)
+
+        embed = discord.Embed(title="📋 Current Queue", description="\n".join(lines), color=0x9b59b6)
+        embed.set_author(name=self.user.display_name, icon_url=self.user.display_avatar.url)
+        head = items[0]
+        if start == 0 and head.download_data.get("thumbnail"):
+            embed.set_thumbnail(url=head.download_data["thumbnail"])
+        channel = head.voice_channel(self.player.bot)
+        if channel is not None:
+            embed.add_field(name="🔊 Voice Channel", value=f"`{channel.name}`", inline=False)
+        embed.set_footer(
+            text=f"Page {self.page + 1}/{self.page_count} • {len(self.player.queue)} tracks"
+        )
+        return embed
+
+    async def _show(self, interaction: discord.Interaction):
+        self._update_buttons()
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="◀️ Prev", style=discord.ButtonStyle.secondary)
+    async def prev_button(self, interaction: discord.Interaction, button: Button):
+        """Previous page"""
+        self.page = max(0, self.page - 1)
+        await self._show(interaction)
+
+    @discord.ui.button(label="Next ▶️", style=discord.ButtonStyle.secondary)
+    async def next_button(self, interaction: discord.Interaction, button: Button):
+        """Next page"""
+        self.page += 1
+        await self._show(interaction)
+
+
+def progress_bar(elapsed: float, duration, width: int = 12) -> str:
+    """Text progress bar like ▬▬▬🔘▬▬▬▬ 1:23 / 3:45"""
+    elapsed_text = f"{int(elapsed // 60)}:{int(elapsed % 60):02d}"
+    if not duration:
+        return elapsed_text
+    filled = min(width - 1, int(elapsed / duration * width))
+    bar = "▬" * filled + "🔘" + "▬" * (width - filled - 1)
+    return f"{bar} {elapsed_text} / {int(duration // 60)}:{int(duration % 60):02d}"
+
+
+class NowPlayingMessage:
+    """Per-guild "now playing" message, edited in place instead of sending new ones
+
+    Updates are coalesced: any number of request_update() calls inside
+    min_interval turn into one edit. While a track plays the message is also
+    refreshed every refresh_interval seconds to move the progress bar.
+    """
+
+    def __init__(self, player, min_interval: float = 5.0, refresh_interval: float = 30.0):
+        self.player = player
+        self.min_interval = min_interval
+        self.refresh_interval = refresh_interval
+        self.message = None
+        self._wake = asyncio.Event()
+        self._task = None
+        self._last_edit = 0.0
+
+    def request_update(self):
+        """Schedules an edit, at most one per min_interval"""
+        self._wake.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            delay = self._last_edit + self.min_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._wake.clear()
+
+            playing = self.player.current is not None
+            await self._publish(playing)
+            self._last_edit = time.monotonic()
+            if not playing and not self._wake.is_set():
+                # Queue finished, the next session gets a fresh message at the bottom
+                self.message = None
+                return
+
+            timeout = self.refresh_interval if playing and self.refresh_interval > 0 else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _publish(self, playing: bool):
+        try:
+            if self.message is not None:
+                if playing:
+                    await self.message.edit(embed=self.render())
+                else:
+                    await self.message.edit(embed=self.render(), view=None)
+                return
+
+            if not playing:
+                return
+            channel = self.player.current.text_channel(self.player.bot)
+            if channel is None:
+                return
+            player = self.player
+            view = MusicControlView(lambda guild_id: player, player.guild_id)
+            self.message = await channel.send(embed=self.render(), view=view)
+        except discord.NotFound:
+            # Deleted by someone, send a new one next time
+            self.message = None
+        except discord.HTTPException as ex:
+            print(f"[{self.player.tag}] failed to update now playing: {ex}")
+
+    def render(self) -> discord.Embed:
+        """Embed for the current player state"""
+        current = self.player.current
+        if current is None:
+            return discord.Embed(title="⏹️ Queue Finished", color=0x95a5a6)
+
+        download_data = current.download_data
+        embed = discord.Embed(
+            title="🎶 Now Playing",
+            description=f"**[{download_data['title']}]({current.url})**",
+            color=0x9b59b6,
+        )
+        if self.player.track_started is None:
+            embed.add_field(name="⏳ Progress", value="Loading...", inline=False)
+        else:
+            elapsed = self.player.position
+            embed.add_field(
+                name="⏱️ Progress",
+                value=progress_bar(elapsed, download_data.get("duration_seconds")),
+                inline=False,
+            )
+
+        upcoming = self.player.queue.page(1, 1)
+        embed.add_field(
+            name="⏭️ Up Next",
+            value=upcoming[0].download_data["title"] if upcoming else "Nothing",
+            inline=True,
+        )
+        embed.add_field(name="📋 Queue", value=f"{len(self.player.queue)} tracks", inline=True)
+        if download_data.get("thumbnail"):
+            embed.set_thumbnail(url=download_data["thumbnail"])
+
+        requester = current.requester(self.player.bot)
+        if requester is not None:
+            embed.set_footer(text=f"Requested by {requester.display_name}")
+        return embed
+
+
+class PrimedSource(discord.AudioSource):
+    """Audio source with its first frames read ahead
+
+    prime() starts reading before playback, so FFmpeg has been spawned and
+    has produced audio by the time the source is played. It blocks, run it
+    off the event loop.
+    """
+
+    def __init__(self, source: discord.AudioSource):
+        self.source = source
+        self._buffer = deque()
+
+    def prime(self, frames: int = PRIME_FRAMES):
+        for _ in range(frames):
+            data = self.source.read()
+            if not data:
+                break
+            self._buffer.append(data)
+        return self
+
+    def read(self) -> bytes:
+        if self._buffer:
+            return self._buffer.popleft()
+        return self.source.read()
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self._buffer.clear()
+        self.source.cleanup()
+
+
+class _TrackedSource(discord.AudioSource):
+    """Wraps an audio source to count frames and report when its first packet is read
+
+    on_first_packet is called once, on the audio thread.
+    """
+
+    def __init__(self, source: discord.AudioSource, on_first_packet):
+        self.source = source
+        self.on_first_packet = on_first_packet
+        self.frames = 0
+
+    def read(self) -> bytes:
+        data = self.source.read()
+        self.frames += 1
+        if self.on_first_packet is not None:
+            on_first_packet, self.on_first_packet = self.on_first_packet, None
+            on_first_packet()
+        return data
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
 
 
 class YoutubeDiscordPlayer:
     """Class for keeping track of youtube music/sound queue"""
 
-    def __init__(self):
-        self.queue = []
+    def __init__(
+        self,
+        bot,
+        guild_id=None,
+        prefetch_depth: int = 2,
+        playback_mode: str = "download",
+        stream_min_duration: int = 1200,
+        idle_timeout: float = 300,
+        now_playing_interval: float = 5.0,
+        now_playing_refresh: float = 30.0,
+        shard_id: int = 0,
+        prewarm_seconds: float = 5.0,
+        progressive_buffer: int = DEFAULT_BUFFER_BYTES,
+        quality: str = "auto",
+    ):
+        self.bot = bot
+        self.queue = TrackQueue()
         self.is_playing = False
-        self.is_stopping = False
-        self.skip_song = False
+        self.guild_id = guild_id
+        # Gateway shard the guild belongs to, 0 when not sharded
+        self.shard_id = shard_id
+        self.tag = str(guild_id)
+        self.prefetch_depth = prefetch_depth
+        # "download", "progressive" (play while downloading), "stream" or "auto"
+        # (stream tracks at least stream_min_duration long)
+        self.playback_mode = playback_mode
+        self.stream_min_duration = stream_min_duration
+        # Bytes on disk before a progressive download starts playing
+        self.progressive_buffer = progressive_buffer
+        # Quality tier, "auto" follows the voice channel's bitrate
+        self.quality = quality
+        # Called with the player whenever the queue or the playing track changes
+        self.on_change = None
+        # _TrackedSource being played, counts frames for the playback position
+        self._source = None
+        # One voice connection is kept for the whole queue, dropped after idle_timeout
+        self.voice_client = None
+        self.idle_timeout = idle_timeout
+        self._idle_task = None
+        # Scheduler state, everything is driven by events so nothing polls while a track plays
+        self._loop = None
+        self._task = None
+        self._current = None
+        self._skip = asyncio.Event()
+        self._track_done = asyncio.Event()
+        # Playlist ingestion tasks, cancelled by stop()
+        self._ingest_tasks = set()
+        # monotonic time the current track started playing, None while loading
+        self.track_started = None
+        # monotonic time the last track ended, for measuring gaps between tracks
+        self._track_ended = None
+        # The next track's source is spawned and primed this long before the current one ends
+        self.prewarm_seconds = prewarm_seconds
+        self._prewarm_task = None
+        # (queue item, location, PrimedSource) ready to play next
+        self._warm = None
+        self.now_playing = NowPlayingMessage(
+            self, min_interval=now_playing_interval, refresh_interval=now_playing_refresh
+        )
+
+    @property
+    def current(self):
+        """Item being played (or loaded), None between tracks"""
+        return self._current
+
+    @property
+    def position(self) -> float:
+        """Seconds into the current track"""
+        if self._current is None:
+            return 0.0
+        frames = self._source.frames if self._source is not None else 0
+        return self._current.seek + frames * FRAME_SECONDS
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def snapshot(self) -> dict:
+        """Queue and playback position, for saving across restarts"""
+        return {
+            "quality": self.quality,
+            "position": self.position,
+            "items": [item.snapshot() for item in self.queue],
+        }
+
+    def restore(self, snapshot: dict) -> int:
+        """Queues the items of a snapshot(), resuming the first at its saved position
+
+        Returns the number of items restored.
+        """
+        self.quality = snapshot.get("quality", self.quality)
+        position = snapshot.get("position", 0.0)
+        for i, data in enumerate(snapshot["items"]):
+            self.queue.append(QueueItem.from_snapshot(data, seek=position if i == 0 else 0.0))
+        self.prefetch()
+        return len(snapshot["items"])
 
     def _can_play(self, queue_item) -> bool:
         if (
-            "channel" in queue_item
-            and "download_data" in queue_item
-            and "file" in queue_item["download_data"]
+            queue_item.channel_id is not None
+            and queue_item.download_data is not None
         ):
             return True
         return False
 
-    def add(self, url, channel, download_data, context=None, interaction=None):
-        """Add song to queue"""
-        self.queue.append(
-            {
-                "url": url,
-                "context": context,
-                "channel": channel,
-                "download_data": download_data,
-                "interaction": interaction,
-            }
+    def add(self, url, channel, download_data, context=None, interaction=None, requested_at=None):
+        """Add song to queue. Only metadata is needed, audio is fetched in background
+
+        Only ids are taken from channel, context and interaction. requested_at
+        is the monotonic time the play command came in, before the track was
+        resolved, now if not given.
+        """
+        item = QueueItem(
+            url=url,
+            channel_id=channel.id,
+            download_data=trim_track(download_data),
+            guild_id=channel.guild.id,
+            stream=self._should_stream(download_data),
+        )
+        if self._current is None and len(self.queue) == 0:
+            item.requested_at = requested_at if requested_at is not None else time.monotonic()
+        if interaction is not None:
+            item.user_id = interaction.user.id
+            item.text_channel_id = interaction.channel_id
+        elif context is not None:
+            item.user_id = context.author.id
+            item.text_channel_id = context.channel.id
+        self.queue.append(item)
+        self.prefetch()
+        if self._current is not None:
+            self.now_playing.request_update()
+        self._changed()
+        return item
+
+    def remove(self, handle: int):
+        """Removes a queued item by handle. Removing the playing item skips it"""
+        item = self.queue.get(handle)
+        if item is None:
+            return None
+        if item is self._current:
+            self.skip()
+            return item
+        was_next = self.queue.page(1, 1) == [item]
+        self.queue.remove(handle)
+        self._release(item)
+        self.prefetch()
+        if was_next:
+            self._rewarm()
+        self._changed()
+        return item
+
+    def play_next(self, handle: int):
+        """Moves a queued item right behind the playing one"""
+        self.queue.move_to_front(handle)
+        if self._current is not None:
+            self.queue.move_to_front(self._current.handle)
+        self.prefetch()
+        self._rewarm()
+        self._changed()
+
+    def shuffle(self):
+        """Shuffles everything after the playing item"""
+        self.queue.shuffle(keep_head=self._current is not None)
+        self.prefetch()
+        self._rewarm()
+        self._changed()
+
+    def ingest(self, batches, channel, context=None, interaction=None, requested_at=None) -> asyncio.Task:
+        """Enqueues tracks from an async iterator of download_data batches in background
+
+        Playback starts with the first batch while the rest are still being
+        listed. The returned task resolves to the number of tracks added.
+        """
+        task = asyncio.create_task(self._ingest(batches, channel, context, interaction, requested_at))
+        self._ingest_tasks.add(task)
+        task.add_done_callback(self._ingest_tasks.discard)
+        return task
+
+    async def _ingest(self, batches, channel, context, interaction, requested_at) -> int:
+        count = 0
+        async for batch in batches:
+            for download_data in batch:
+                self.add(download_data["url"], channel, download_data, context, interaction, requested_at)
+                count += 1
+            await self.start()
+        return count
+
+    def _should_stream(self, download_data) -> bool:
+        """Picks streaming or cached playback for a track"""
+        if self.playback_mode == "stream":
+            return True
+        if self.playback_mode == "auto":
+            duration = download_data.get("duration_seconds") or 0
+            return duration >= self.stream_min_duration
+        return False
+
+    def prefetch(self):
+        """Starts background downloads for the current track and the next few"""
+        for item in self.queue.page(0, self.prefetch_depth + 1):
+            if item.download_task is None:
+                item.download_task = asyncio.create_task(self._fetch(item))
+
+    def _format_key(self, queue_item) -> str:
+        """Format key for the player's quality tier and the item's voice channel"""
+        bitrate = None
+        if self.quality == "auto" and self.bot is not None:
+            channel = queue_item.voice_channel(self.bot)
+            bitrate = getattr(channel, "bitrate", None)
+        return quality_format_key(self.quality, bitrate)
+
+    async def _fetch(self, queue_item) -> str:
+        """Gets a playable location for a queue item
+
+        Streamed items resolve a direct media url. Everything else is downloaded
+        and the file is pinned until the item is released. In progressive mode
+        this returns once the start of the file is on disk.
+        """
+        if queue_item.stream:
+            duration = queue_item.download_data.get("duration_seconds") or 0
+            download_data = await resolve_stream(
+                queue_item.url,
+                self.tag,
+                min_lifetime=duration + STREAM_MARGIN,
+                fmt_key=self._format_key(queue_item),
+            )
+            queue_item.download_data = trim_track(download_data)
+            return download_data["stream_url"]
+
+        if self.playback_mode == "progressive":
+            download_data, queue_item.file_task = await download_progressive(
+                queue_item.url,
+                self.tag,
+                min_bytes=self.progressive_buffer,
+                fmt_key=self._format_key(queue_item),
+            )
+        else:
+            download_data = await download(queue_item.url, self.tag, self._format_key(queue_item))
+        get_cache().pin(download_data["file"])
+        queue_item.download_data = trim_track(download_data)
+        return download_data["file"]
+
+    def _release(self, queue_item):
+        """Unpins a queue item's file, now or once its download finishes"""
+        task = queue_item.download_task
+        if task is None or queue_item.stream:
+            return
+
+        def unpin(done_task):
+            if not done_task.cancelled() and done_task.exception() is None:
+                get_cache().unpin(done_task.result())
+
+        # Pending downloads are left to finish so they still fill the cache
+        if task.done():
+            unpin(task)
+        else:
+            task.add_done_callback(unpin)
+
+    @staticmethod
+    def _is_still_valid(queue_item, location) -> bool:
+        """Whether a fetched location can still be played"""
+        if queue_item.stream:
+            # The url has to outlive the track or FFmpeg reconnects will fail
+            duration = queue_item.download_data.get("duration_seconds") or 0
+            return stream_is_fresh(queue_item.download_data, margin=duration + STREAM_MARGIN)
+        return os.path.exists(location) or download_finished_event(location) is not None
+
+    @staticmethod
+    def _create_source(queue_item, location) -> discord.AudioSource:
+        """FFmpeg source that hands Opus packets to discord.py
+
+        Opus sources are remuxed with codec copy, anything else is encoded by
+        FFmpeg, so discord.py never has to encode audio itself. Files still
+        being downloaded are piped in through a TailReader.
+        """
+        download_data = queue_item.download_data
+        before_options = None
+        if queue_item.stream:
+            before_options = download_data["stream_before_options"]
+        if queue_item.seek > 0:
+            # Resuming, start where the track was when the bot stopped
+            before_options = f"{before_options or ''} -ss {queue_item.seek:.2f}".strip()
+
+        pipe = False
+        if not queue_item.stream:
+            finished = download_finished_event(location)
+            if finished is not None:
+                location = TailReader(location, finished)
+                pipe = True
+
+        codec = "copy" if is_opus(download_data) else None
+        return discord.FFmpegOpusAudio(
+            location, codec=codec, pipe=pipe, before_options=before_options
+        )
+
+    async def _prewarm_next(self, current, tracked):
+        """Spawns and primes the next track's source shortly before current ends
+
+        Elapsed time is counted in frames sent, so pauses and slow voice
+        connections don't make it fire early. Frames only lag wall time, so
+        sleeping for the time left and checking again wakes about once a track.
+        """
+        duration = current.download_data.get("duration_seconds")
+        if not duration:
+            return
+        while True:
+            remaining = duration - self.prewarm_seconds - current.seek - tracked.frames * FRAME_SECONDS
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+
+        upcoming = self.queue.page(1, 1)
+        if not upcoming or upcoming[0].download_task is None:
+            return
+        item = upcoming[0]
+        # asyncio.wait doesn't cancel the download if this task is cancelled
+        await asyncio.wait({item.download_task})
+        task = item.download_task
+        if task.cancelled() or task.exception() is not None:
+            return
+        location = task.result()
+        if not self._is_still_valid(item, location):
+            return
+
+        priming = asyncio.ensure_future(
+            asyncio.to_thread(lambda: PrimedSource(self._create_source(item, location)).prime())
         )
+        try:
+            source = await asyncio.shield(priming)
+        except asyncio.CancelledError:
+            # The thread can't be stopped, clean up whatever it ends up spawning
+            priming.add_done_callback(
+                lambda f: f.cancelled() or f.exception() is not None or f.result().cleanup()
+            )
+            raise
+        self._discard_warm()
+        self._warm = (item, location, source)
+
+    def _take_warm(self, queue_item, location):
+        """Primed source for queue_item if one was prepared for location, else None"""
+        warm, self._warm = self._warm, None
+        if warm is None:
+            return None
+        if warm[0] is queue_item and warm[1] == location:
+            return warm[2]
+        warm[2].cleanup()
+        return None
+
+    def _discard_warm(self):
+        """Drops the primed source and stops preparing one"""
+        if self._prewarm_task is not None:
+            self._prewarm_task.cancel()
+            self._prewarm_task = None
+        warm, self._warm = self._warm, None
+        if warm is not None:
+            warm[2].cleanup()
+
+    def _rewarm(self):
+        """Drops a source primed for a track that may not be next anymore and prepares the new next one"""
+        self._discard_warm()
+        if self._current is not None and self._source is not None and self.prewarm_seconds > 0:
+            self._prewarm_task = asyncio.create_task(self._prewarm_next(self._current, self._source))
+
+    async def _ensure_voice(self, channel) -> discord.VoiceClient:
+        """Returns the guild's voice client in channel, connecting or moving only when needed"""
+        self._cancel_idle_disconnect()
+
+        vc = channel.guild.voice_client
+        if vc is not None and not vc.is_connected():
+            # Voice websocket dropped and discord.py gave up reconnecting
+            print(f"[{self.tag}] voice connection lost, reconnecting")
+            await vc.disconnect(force=True)
+            vc = None
+
+        if vc is None:
+            with VOICE_CONNECT_SECONDS.time():
+                vc = await channel.connect(reconnect=True)
+        elif vc.channel != channel:
+            with VOICE_CONNECT_SECONDS.time():
+                await vc.move_to(channel)
+
+        self.voice_client = vc
+        return vc
+
+    def _cancel_idle_disconnect(self):
+        if self._idle_task is not None:
+            self._idle_task.cancel()
+            self._idle_task = None
+
+    def _schedule_idle_disconnect(self):
+        """Disconnects from voice once nothing has been played for idle_timeout"""
+        self._cancel_idle_disconnect()
+        if self.voice_client is not None:
+            self._idle_task = asyncio.create_task(self._idle_disconnect())
+
+    async def _idle_disconnect(self):
+        await asyncio.sleep(self.idle_timeout)
+        vc = self.voice_client
+        self.voice_client = None
+        self._idle_task = None
+        if vc is not None and vc.is_connected():
+            await vc.disconnect()
 
     def skip(self):
-        """Sets skip_song which gets checked while song is running"""
-        self.skip_song = True
+        """Skips the current track right away, even if it is still downloading
+
+        Also works before the scheduler got to the head of the queue, that
+        track is skipped as soon as it's picked up.
+        """
+        # With nothing to skip the event would carry over to the next track queued
+        if self._current is not None or len(self.queue) != 0:
+            self._skip.set()
+        vc = self.voice_client
+        if vc is not None and (vc.is_playing() or vc.is_paused()):
+            vc.stop()
 
     async def start(self):
-        """Starts playing from the queue. Ends once the queue is empty"""
+        """Starts the scheduler for the queue if it isn't running. Returns immediately"""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
         self.is_playing = True
-        self.is_stopping = False
+        self._task = asyncio.create_task(self._run())
 
-        while len(self.queue) != 0:
-            next_video = self.queue[0]
-            if self._can_play(next_video):
+    async def _run(self):
+        """Plays from the queue until it is empty"""
+        try:
+            while len(self.queue) != 0:
+                next_video = self.queue.head()
+                if not self._can_play(next_video):
+                    print(f"[{self.tag}] dropping unplayable item {next_video.url}")
+                    self.queue.popleft()
+                    self._release(next_video)
+                    continue
                 await self.play_and_pop(next_video)
-
-        self.is_playing = False
+        finally:
+            self.is_playing = False
+            self._track_ended = None
+            self._discard_warm()
+            self._schedule_idle_disconnect()
 
     async def stop(self):
-        """Stops the queue and resets"""
-        self.queue = []
-        self.is_stopping = True
-        self.is_playing = False
-        self.skip_song = True
+        """Stops the queue, cancels playlist ingestion and resets"""
+        for task in list(self._ingest_tasks):
+            task.cancel()
+        # The playing item is released by play_and_pop
+        for item in self.queue:
+            if item is not self._current:
+                self._release(item)
+        self.queue.clear()
+        self._discard_warm()
+        self.skip()
+        self.now_playing.request_update()
+        self._changed()
 
-    async def play_and_pop(self, play_info):
-        """Plays audio file from play_info and then removes from the queue"""
-        file = play_info["download_data"]["file"]
-        if not os.path.exists(file):
-            download_data = await download(play_info["url"])
-            file = download_data["file"]
+    def _after_track(self, error):
+        """vc.play() callback, runs on the audio thread"""
+        if error is not None:
+            print(f"[{self.tag}] player error: {error}")
+        self._track_ended = time.monotonic()
+        self._loop.call_soon_threadsafe(self._track_done.set)
 
-        vc = await play_info["channel"].connect()
-        source = discord.FFmpegPCMAudio(file)
+    def _first_packet(self, queue_item, at: float):
+        """Records startup latency and the gap since the previous track"""
+        if queue_item.requested_at is not None:
+            FIRST_AUDIO_SECONDS.observe(at - queue_item.requested_at)
+            queue_item.requested_at = None
+        if self._track_ended is not None:
+            TRACK_GAP_SECONDS.observe(at - self._track_ended)
+            self._track_ended = None
 
+    async def _wait_unless_skipped(self, task):
+        """Waits for task, returns None instead if the track gets skipped first"""
+        skipped = asyncio.ensure_future(self._skip.wait())
         try:
-            vc.play(source)
-            while vc.is_playing():
-                if self.skip_song:
-                    vc.stop()
-                    self.skip_song = False
-                await asyncio.sleep(1.0)
-        except Exception as e:
-            print(e)
+            # asyncio.wait doesn't cancel task, so a skipped download still fills the cache
+            done, _ = await asyncio.wait({task, skipped}, return_when=asyncio.FIRST_COMPLETED)
         finally:
-            if not self.is_stopping:
-                self.queue.pop(0)
+            skipped.cancel()
+        if task not in done:
+            return None
+        return task.result()
 
-            files = [
-                item["download_data"]["file"]
-                for item in self.queue
-                if self._can_play(item)
-            ]
-            if not file in files:
-                os.remove(file)
+    async def _report_failed_download(self, play_info):
+        """Tells the channel a progressive download died mid track, the track ended early"""
+        task = play_info.file_task
+        if task is None or not task.done() or task.cancelled() or task.exception() is None:
+            return
+        print(f"[{self.tag}] download of {play_info.url} failed while playing: {task.exception()}")
+        channel = play_info.text_channel(self.bot)
+        if channel is None:
+            return
+        embed = discord.Embed(
+            title="❌ Playback Interrupted",
+            description=f"Download of **{play_info.download_data['title']}** failed, skipped the rest",
+            color=0xe74c3c,
+        )
+        try:
+            await channel.send(embed=embed)
+        except discord.HTTPException as ex:
+            print(f"[{self.tag}] failed to report download failure: {ex}")
 
-            await vc.disconnect()
+    async def play_and_pop(self, play_info):
+        """Waits for the prefetched audio file, plays it and then removes it from the queue"""
+        self._current = play_info
+        self.prefetch()
+        self.now_playing.request_update()
+        try:
+            location = await self._wait_unless_skipped(play_info.download_task)
+            if location is not None and not self._is_still_valid(play_info, location):
+                # Signed url expired while queued or file removed from under us
+                self._release(play_info)
+                play_info.download_task = asyncio.create_task(self._fetch(play_info))
+                location = await self._wait_unless_skipped(play_info.download_task)
+            if location is None:
+                return
+
+            channel = play_info.voice_channel(self.bot)
+            if channel is None:
+                print(f"[{self.tag}] voice channel {play_info.channel_id} is gone, dropping {play_info.url}")
+                return
+            vc = await self._ensure_voice(channel)
+            if self._skip.is_set():
+                return
+            source = self._take_warm(play_info, location)
+            if source is None:
+                source = self._create_source(play_info, location)
+            source = _TrackedSource(
+                source,
+                lambda: self._loop.call_soon_threadsafe(
+                    self._first_packet, play_info, time.monotonic()
+                ),
+            )
+
+            self._track_done.clear()
+            self._source = source
+            vc.play(source, after=self._after_track)
+            self.track_started = time.monotonic()
+            get_track_index().played(play_info.download_data.get("id"))
+            self.now_playing.request_update()
+            self._changed()
+            if self.prewarm_seconds > 0:
+                self._prewarm_task = asyncio.create_task(self._prewarm_next(play_info, source))
+            await self._track_done.wait()
+            await self._report_failed_download(play_info)
+        except Exception as e:
+            print(f"[{self.tag}] failed to play {play_info.url}: {e}")
+        finally:
+            if self._prewarm_task is not None and not self._prewarm_task.done():
+                self._prewarm_task.cancel()
+            self._prewarm_task = None
+            # Cleared once the track is over, a skip requested before it started still counts
+            self._skip.clear()
+            self._current = None
+            self._source = None
+            self.track_started = None
+            if self.queue.head() is play_info:
+                self.queue.popleft()
+            self.now_playing.request_update()
+            self._changed()
+
+            # Keep the file around for later plays, the cache evicts when over budget
+            self._release(play_info)
 
 
 class YoutubeCommands(commands.Cog):
@@ -162,6 +919,110 @@ class YoutubeCommands(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.players = {}
+        self.prefetch_depth = int(os.getenv("YTDB_PREFETCH_DEPTH", "2"))
+        self.playback_mode = os.getenv("YTDB_PLAYBACK_MODE", "download")
+        self.stream_min_duration = int(os.getenv("YTDB_STREAM_MIN_DURATION", "1200"))
+        self.idle_timeout = float(os.getenv("YTDB_IDLE_TIMEOUT", "300"))
+        self.playlist_limit = int(os.getenv("YTDB_PLAYLIST_MAX", "200"))
+        self.now_playing_interval = float(os.getenv("YTDB_NOW_PLAYING_INTERVAL", "5"))
+        self.now_playing_refresh = float(os.getenv("YTDB_NOW_PLAYING_REFRESH", "30"))
+        # Plays within this window are announced together in one message
+        self.add_batch_window = float(os.getenv("YTDB_ADD_BATCH_WINDOW", "1.5"))
+        self.prewarm_seconds = float(os.getenv("YTDB_PREWARM_SECONDS", "5"))
+        self.progressive_buffer = int(os.getenv("YTDB_PROGRESSIVE_BUFFER", str(DEFAULT_BUFFER_BYTES)))
+        # Default quality tier for new players, changed per guild with the quality command
+        self.quality = os.getenv("YTDB_QUALITY", "auto")
+        self.snapshots = get_queue_snapshots()
+        self.admission = get_admission()
+        self._add_batches = {}
+        self.metrics_server = get_metrics_server()
+        self._metrics_started = False
+        self._warmed_up = False
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        """Warms up yt-dlp (thread backend only) and starts the metrics endpoint once the bot is connected"""
+        if not self._warmed_up:
+            self._warmed_up = True
+            warm_up()
+            # Load the track index now rather than on the first autocomplete
+            get_track_index()
+        if self.metrics_server is None or self._metrics_started:
+            return
+        self._metrics_started = True
+        VOICE_CLIENTS.set_collect(lambda: len(self.bot.voice_clients))
+        QUEUE_DEPTH.set_collect(
+            lambda: [
+                ({"guild": guild_id}, len(player.queue))
+                for guild_id, player in self.players.items()
+                if len(player.queue)
+            ]
+        )
+        service = get_service()
+        POOL_BUSY.set_collect(lambda: service.busy)
+        POOL_QUEUED.set_collect(lambda: service.queued)
+        POOL_SATURATION.set_collect(lambda: service.busy / service.workers)
+        CACHE_BYTES.set_collect(lambda: get_cache().total_bytes)
+        CACHE_FILES.set_collect(lambda: len(get_cache().entries))
+        try:
+            await self.metrics_server.start()
+        except OSError as ex:
+            print(f"metrics endpoint failed to start: {ex}")
+
+    async def cog_unload(self):
+        if self._metrics_started:
+            await self.metrics_server.stop()
+        if self.snapshots is not None:
+            self.snapshots.flush()
+
+    def _get_player(self, guild_id) -> YoutubeDiscordPlayer:
+        """Gets or creates the player for a guild"""
+        if guild_id not in self.players:
+            self.players[guild_id] = YoutubeDiscordPlayer(
+                self.bot,
+                guild_id,
+                prefetch_depth=self.prefetch_depth,
+                playback_mode=self.playback_mode,
+                stream_min_duration=self.stream_min_duration,
+                idle_timeout=self.idle_timeout,
+                now_playing_interval=self.now_playing_interval,
+                now_playing_refresh=self.now_playing_refresh,
+                shard_id=self._shard_id(guild_id),
+                prewarm_seconds=self.prewarm_seconds,
+                progressive_buffer=self.progressive_buffer,
+                quality=self.quality,
+            )
+            if self.snapshots is not None:
+                self._restore_player(self.players[guild_id])
+        return self.players[guild_id]
+
+    def _find_player(self, guild_id):
+        """The guild's player, None if it has none
+
+        A guild with a queue saved before the last restart gets its player
+        (and queue) back here, whatever command it uses first.
+        """
+        player = self.players.get(guild_id)
+        if player is None and self.snapshots is not None and self.snapshots.has(guild_id):
+            player = self._get_player(guild_id)
+        return player
+
+    def _restore_player(self, player):
+        """Resumes the queue saved before the last restart, if any, and keeps saving it"""
+        restored = self.snapshots.restore(player)
+        player.on_change = self.snapshots.mark_dirty
+        if restored:
+            print(f"[{player.tag}] restored {restored} queued tracks")
+            asyncio.create_task(player.start())
+
+    def _shard_id(self, guild_id) -> int:
+        """Shard a guild is served by, same formula Discord uses"""
+        shard_count = self.bot.shard_count or 1
+        return (guild_id >> 22) % shard_count
+
+    def shard_players(self, shard_id: int) -> list:
+        """Players of guilds on one shard"""
+        return [player for player in self.players.values() if player.shard_id == shard_id]
 
     def create_premium_embed(self, download_data, user, action="Added to Queue"):
         """Create a premium styled embed with thumbnail"""
@@ -191,6 +1052,110 @@ class YoutubeCommands(commands.Cog):
         
         return embed
 
+    async def _announce_added(self, guild_id, download_data, user, send, ack=None):
+        """Announces a queued track right away, merging plays that follow within add_batch_window
+
+        The first play sends its announcement with send at once. Later plays
+        in the window only call ack, and when the window ends the first
+        announcement is edited into one message listing the whole batch.
+        """
+        batch = self._add_batches.get(guild_id)
+        if batch is not None:
+            batch.append(download_data)
+            if ack is not None:
+                await ack()
+            return
+
+        batch = self._add_batches[guild_id] = [download_data]
+        try:
+            message = await send(
+                embed=self.create_premium_embed(download_data, user),
+                view=MusicControlView(self._find_player, guild_id),
+            )
+            await asyncio.sleep(self.add_batch_window)
+        finally:
+            del self._add_batches[guild_id]
+        if len(batch) == 1 or message is None:
+            return
+
+        lines = [f"• **{data['title']}**" for data in batch[:10]]
+        if len(batch) > 10:
+            lines.append(f"...and {len(batch) - 10} more")
+        embed = discord.Embed(
+            title=f"🎵 Added {len(batch)} tracks",
+            description="\n".join(lines),
+            color=0x9b59b6,
+        )
+        embed.set_author(name=user.display_name, icon_url=user.display_avatar.url)
+        try:
+            await message.edit(embed=embed)
+        except discord.HTTPException as ex:
+            print(f"[{guild_id}] failed to update the added tracks message: {ex}")
+
+    async def _enqueue_playlist(
+        self, guild_id, url, channel, user, send, context=None, interaction=None, requested_at=None
+    ):
+        """Queues a playlist batch by batch, announcing it when it starts and when it's done"""
+        player = self._get_player(guild_id)
+        limit = min(self.playlist_limit, self.admission.queue_room(len(player.queue)))
+        task = player.ingest(
+            self.admission.filter_batches(iter_playlist(url, str(guild_id), limit)),
+            channel,
+            context=context,
+            interaction=interaction,
+            requested_at=requested_at,
+        )
+
+        embed = discord.Embed(
+            title="📃 Loading Playlist",
+            description=f"[Link]({url})\nUp to {limit} tracks, playback starts with the first few",
+            color=0x9b59b6,
+        )
+        embed.set_author(name=user.display_name, icon_url=user.display_avatar.url)
+        await send(embed=embed, view=MusicControlView(self._find_player, guild_id))
+
+        await asyncio.wait({task})
+        if task.cancelled():
+            # Stopped, the stop command already said so
+            return
+        if task.exception() is not None:
+            print(type(task.exception()), task.exception())
+            self.admission.refund(guild_id, user.id)
+            embed = discord.Embed(title="❌ Failed to load playlist", color=0xe74c3c)
+            embed.set_author(name=user.display_name, icon_url=user.display_avatar.url)
+            embed.add_field(name="Failure", value=f"[Link]({url})")
+            await send(embed=embed)
+            return
+
+        embed = discord.Embed(
+            title="📃 Playlist Added",
+            description=f"Added **{task.result()}** tracks to the queue",
+            color=0x9b59b6,
+        )
+        embed.set_author(name=user.display_name, icon_url=user.display_avatar.url)
+        await send(embed=embed)
+
+    def _admit(self, guild_id, user_id) -> str:
+        """Rate and queue limits for a play request, checked before any yt-dlp work
+
+        Returns why the request was rejected, None if it may go ahead. An
+        admitted request that ends up queueing nothing refunds its tokens.
+        """
+        player = self._find_player(guild_id)
+        return self.admission.check(guild_id, user_id, len(player.queue) if player else 0)
+
+    async def _resolve_admitted(self, url, guild_id, user_id) -> dict:
+        """resolve() for an admitted request, refunding its tokens if it fails"""
+        try:
+            return await resolve(url, str(guild_id))
+        except Exception:
+            self.admission.refund(guild_id, user_id)
+            raise
+
+    def create_rejected_embed(self, reason) -> discord.Embed:
+        """Embed telling why a play request wasn't queued"""
+        return discord.Embed(title="⛔ Not Queued", description=reason, color=0xe74c3c)
+
     async def _get_channel_by_context(
         self, context: commands.Context, channel_name: commands.clean_content = None
     ):
@@ -318,6 +1283,57 @@ class YoutubeCommands(commands.Cog):
             await self.bot.tree.sync()
             await ctx.reply(f"Un-Synced global !")
 
+    ### STATS SECTION ###
+
+    @commands.command()
+    @commands.is_owner()
+    async def cachestats(self, ctx: commands.Context) -> None:
+        """Shows metadata and audio cache stats, and requests served by an in-flight one"""
+        metadata = get_metadata_cache().stats()
+        audio = get_cache()
+
+        embed = discord.Embed(title="📊 Cache Stats", color=0x3498db)
+        embed.add_field(
+            name="Metadata",
+            value=(
+                f"{metadata['entries']} entries\n"
+                f"{metadata['hit_rate']:.1%} hit rate ({metadata['hits']}/{metadata['hits'] + metadata['misses']})\n"
+                f"{metadata['avg_lookup_us']:.1f} µs avg lookup"
+            ),
+            inline=False,
+        )
+        embed.add_field(
+            name="Audio",
+            value=f"{len(audio.entries)} files, {audio.total_bytes / 1024 / 1024:.1f} / {audio.max_bytes / 1024 / 1024:.0f} MiB",
+            inline=False,
+        )
+        embed.add_field(
+            name="Coalesced",
+            value=f"{coalesced_requests()} requests joined an identical one in flight",
+            inline=False,
+        )
+        await ctx.reply(embed=embed)
+
+    @commands.command()
+    @commands.is_owner()
+    async def shardstats(self, ctx: commands.Context) -> None:
+        """Shows latency, guilds and active players per shard of this process"""
+        latencies = getattr(self.bot, "latencies", None) or [(0, self.bot.latency)]
+        embed = discord.Embed(
+            title="📡 Shard Stats",
+            description=f"{len(latencies)} shards, {len(self.bot.guilds)} guilds in this process",
+            color=0x3498db,
+        )
+        for shard_id, latency in latencies[:25]:
+            guilds = sum(1 for guild in self.bot.guilds if guild.shard_id == shard_id)
+            playing = sum(1 for player in self.shard_players(shard_id) if player.is_playing)
+            embed.add_field(
+                name=f"Shard {shard_id}",
+                value=f"{latency * 1000:.0f} ms\n{guilds} guilds\n{playing} playing",
+                inline=True,
+            )
+        await ctx.reply(embed=embed)
+
     ### PLAY SECTION ###
 
     @commands.command(
@@ -330,35 +1346,48 @@ class YoutubeCommands(commands.Cog):
         self, context: commands.Context, url: str, *, channel_name: str = None
     ):
         """Play YouTube audio with premium UI"""
+        # Startup latency is measured from here, resolving the track is part of it
+        requested_at = time.monotonic()
         guild_id = context.author.guild.id
 
+        rejected = self._admit(guild_id, context.author.id)
+        if rejected is not None:
+            await context.reply(embed=self.create_rejected_embed(rejected))
+            return
+
         channel = await self._get_channel_by_context(context, channel_name)
         if channel is None:
+            self.admission.refund(guild_id, context.author.id)
             return
 
-        download_data = await download(url, str(guild_id))
-
-        # Create premium embed with thumbnail
-        embed = self.create_premium_embed(download_data, context.author)
-        
-        # Create control view
-        view = MusicControlView(self.players, guild_id)
-        
-        await context.send(embed=embed, view=view)
+        if is_playlist_url(url):
+            await self._enqueue_playlist(
+                guild_id, url, channel, context.author, context.send,
+                context=context, requested_at=requested_at,
+            )
+            return
 
-        if guild_id not in self.players:
-            self.players[guild_id] = YoutubeDiscordPlayer()
+        download_data = await self._resolve_admitted(url, guild_id, context.author.id)
+        rejected = self.admission.check_duration(download_data)
+        if rejected is not None:
+            self.admission.refund(guild_id, context.author.id)
+            await context.reply(embed=self.create_rejected_embed(rejected))
+            return
 
-        self.players[guild_id].add(
+        self._get_player(guild_id).add(
             url=download_data["url"],
             channel=channel,
             download_data=download_data,
             context=context,
             interaction=None,
+            requested_at=requested_at,
         )
         if not self.players[guild_id].is_playing:
             await self.players[guild_id].start()
 
+        # Premium embed, shared with other plays arriving right after this one
+        await self._announce_added(guild_id, download_data, context.author, context.send)
+
     @discord.app_commands.command(
         name="p",
         description="Play Youtube audio lewat url beb",
@@ -368,69 +1397,121 @@ class YoutubeCommands(commands.Cog):
         self, interaction: discord.Interaction, url: str, channel_name: str = None
     ):
         """Play YouTube audio with premium UI (slash command)"""
-        await interaction.response.defer()
+        # Startup latency is measured from here, resolving the track is part of it
+        requested_at = time.monotonic()
         guild_id = interaction.guild.id
+        rejected = self._admit(guild_id, interaction.user.id)
+        if rejected is not None:
+            await interaction.response.send_message(
+                embed=self.create_rejected_embed(rejected), ephemeral=True
+            )
+            return
+        # A play joining an open batch is only acked, privately. A public defer
+        # would make that ack replace the public "thinking" message
+        private = not is_playlist_url(url) and guild_id in self._add_batches
+        await interaction.response.defer(ephemeral=private)
 
         channel = await self._get_channel_by_interaction(interaction, channel_name)
         if channel is None:
+            self.admission.refund(guild_id, interaction.user.id)
             return
 
-        download_data = await download(url, str(guild_id))
-
-        # Create premium embed with thumbnail
-        embed = self.create_premium_embed(download_data, interaction.user)
-        
-        # Create control view
-        view = MusicControlView(self.players, guild_id)
-        
-        await interaction.followup.send(embed=embed, view=view)
+        if is_playlist_url(url):
+            await self._enqueue_playlist(
+                guild_id,
+                url,
+                channel,
+                interaction.user,
+                interaction.followup.send,
+                interaction=interaction,
+                requested_at=requested_at,
+            )
+            return
 
-        if guild_id not in self.players:
-            self.players[guild_id] = YoutubeDiscordPlayer()
+        download_data = await self._resolve_admitted(url, guild_id, interaction.user.id)
+        rejected = self.admission.check_duration(download_data)
+        if rejected is not None:
+            self.admission.refund(guild_id, interaction.user.id)
+            await interaction.followup.send(embed=self.create_rejected_embed(rejected))
+            return
 
-        self.players[guild_id].add(
+        self._get_player(guild_id).add(
             url=download_data["url"],
             channel=channel,
             download_data=download_data,
             context=None,
             interaction=interaction,
+            requested_at=requested_at,
         )
         if not self.players[guild_id].is_playing:
             await self.players[guild_id].start()
 
+        async def ack():
+            if not private:
+                # The batch was opened while resolving, keep the ack out of the channel
+                await interaction.delete_original_response()
+            await interaction.followup.send(f"✅ Queued **{download_data['title']}**", ephemeral=True)
+
+        async def send(**kwargs):
+            if not private:
+                return await interaction.followup.send(**kwargs)
+            # The batch closed while resolving, the announcement still goes to the channel
+            message = await interaction.channel.send(**kwargs)
+            await ack()
+            return message
+
+        # Premium embed, shared with other plays arriving right after this one.
+        # Interactions that don't open the batch still need a response
+        await self._announce_added(guild_id, download_data, interaction.user, send, ack=ack)
+
+    @qplay.autocomplete("url")
+    async def qplay_url_autocomplete(self, interaction: discord.Interaction, current: str):
+        """Suggests tracks the bot has played before, from the local index only
+
+        Autocomplete has to answer within 3 seconds, so this never asks Youtube.
+        Urls are left alone and anything typed can still be submitted as is.
+        """
+        if current.startswith(("http://", "https://")):
+            return []
+        choices = []
+        for video_id, title, uploader, plays in get_track_index().search(current, limit=25):
+            name = f"{title} — {uploader}" if uploader else title
+            choices.append(
+                discord.app_commands.Choice(
+                    name=name[:100], value=f"https://www.youtube.com/watch?v={video_id}"
+                )
+            )
+        return choices
+
     ### STOP SECTION ###
 
+    async def _stop_player(self, guild_id):
+        """Stops the guild's player and forgets its saved queue, restored or not"""
+        player = self.players.get(guild_id)
+        if player is not None:
+            await player.stop()
+        if self.snapshots is not None:
+            self.snapshots.discard(guild_id)
+
     @commands.command(name="stop", help="Stops semua musik yang lagi diputar termasuk kuewe beb")
     async def stop(self, context: commands.Context):
         """Stops all and clears queue"""
-        embed = discord.Embed(title="⏹️ Stopping Playback", color=0xe74c3c)
-        embed.set_author(
-            name=context.author.display_name, icon_url=context.author.display_avatar.url
-        )
-        embed.description = "Queue cleared and playback stopped"
-        await context.send(embed=embed)
-
         guild_id = context.author.guild.id
-        if guild_id in self.players:
-            await self.players[guild_id].stop()
+        await self._stop_player(guild_id)
+
+        # The now playing message shows the result, just acknowledge the command
+        await context.message.add_reaction("⏹️")
 
     @discord.app_commands.command(
         name="st", description="Stops semua musik yang lagi diputar termasuk kuewe beb"
     )
     async def qstop(self, interaction: discord.Interaction):
         """Stops all and clears queue (slash command)"""
-        await interaction.response.defer()
-        embed = discord.Embed(title="⏹️ Stopping Playback", color=0xe74c3c)
-        embed.set_author(
-            name=interaction.user.display_name,
-            icon_url=interaction.user.display_avatar.url,
-        )
-        embed.description = "Queue cleared and playback stopped"
-        await interaction.followup.send(embed=embed)
-
+        await interaction.response.defer(ephemeral=True)
         guild_id = interaction.user.guild.id
-        if guild_id in self.players:
-            await self.players[guild_id].stop()
+        await self._stop_player(guild_id)
+
+        await interaction.followup.send("⏹️ Queue cleared and playback stopped", ephemeral=True)
 
     ### SKIP SECTION ###
 
@@ -438,8 +1519,9 @@ class YoutubeCommands(commands.Cog):
     async def skip(self, context: commands.Context):
         """Skips current audio playing in the queue"""
         guild_id = context.author.guild.id
+        player = self._find_player(guild_id)
 
-        if guild_id not in self.players or len(self.players[guild_id].queue) == 0:
+        if player is None or len(player.queue) == 0:
             embed = discord.Embed(title="❌ Nothing in Queue", color=0x95a5a6)
             embed.set_author(
                 name=context.author.display_name,
@@ -448,125 +1530,163 @@ class YoutubeCommands(commands.Cog):
             await context.send(embed=embed)
             return
 
-        current = self.players[guild_id].queue[0]
-        download_data = current["download_data"]
-        url = current["url"]
-        
-        embed = discord.Embed(title="⏭️ Skipping Track", color=0x3498db)
-        embed.set_author(
-            name=context.author.display_name,
-            icon_url=context.author.display_avatar.url,
-        )
-        embed.add_field(name=download_data["title"], value=f"[Link]({url})", inline=False)
-        
-        if 'thumbnail' in download_data and download_data['thumbnail']:
-            embed.set_thumbnail(url=download_data['thumbnail'])
-        
-        await context.send(embed=embed)
-        self.players[guild_id].skip()
+        # The now playing message moves on to the next track by itself
+        player.skip()
+        await context.message.add_reaction("⏭️")
 
     @discord.app_commands.command(name="sk", description="Skips current musik yang lagi diputar beb")
     async def qskip(self, interaction: discord.Interaction):
         """Skips current audio playing in the queue (slash command)"""
-        await interaction.response.defer()
+        await interaction.response.defer(ephemeral=True)
         guild_id = interaction.user.guild.id
+        player = self._find_player(guild_id)
 
-        if guild_id not in self.players or len(self.players[guild_id].queue) == 0:
+        if player is None or len(player.queue) == 0:
             embed = discord.Embed(title="❌ Nothing in Queue", color=0x95a5a6)
             embed.set_author(
                 name=interaction.user.display_name,
                 icon_url=interaction.user.display_avatar.url,
             )
-            await interaction.followup.send(embed=embed)
+            await interaction.followup.send(embed=embed, ephemeral=True)
             return
 
-        current = self.players[guild_id].queue[0]
-        download_data = current["download_data"]
-        url = current["url"]
-        
-        embed = discord.Embed(title="⏭️ Skipping Track", color=0x3498db)
-        embed.set_author(
-            name=interaction.user.display_name,
-            icon_url=interaction.user.display_avatar.url,
-        )
-        embed.add_field(name=download_data["title"], value=f"[Link]({url})", inline=False)
-        
-        if 'thumbnail' in download_data and download_data['thumbnail']:
-            embed.set_thumbnail(url=download_data['thumbnail'])
-        
-        await interaction.followup.send(embed=embed)
-        self.players[guild_id].skip()
+        title = player.queue.head().download_data["title"]
+        player.skip()
+        await interaction.followup.send(f"⏭️ Skipped **{title}**", ephemeral=True)
+
+    ### QUALITY SECTION ###
+
+    def _set_quality(self, guild_id, tier) -> discord.Embed:
+        """Shows or changes a guild's quality tier"""
+        player = self._get_player(guild_id)
+        tiers = ", ".join(["auto"] + [f"{name} ({kbps} kbps)" for name, kbps in QUALITY_TIERS.items()])
+        if tier is None:
+            embed = discord.Embed(title=f"🎚️ Quality: {player.quality}", color=0x3498db)
+        elif tier != "auto" and tier not in QUALITY_TIERS:
+            embed = discord.Embed(title=f"❌ Unknown quality {tier}", color=0xe74c3c)
+        else:
+            player.quality = tier
+            if self.snapshots is not None:
+                self.snapshots.save_quality(guild_id, tier)
+            embed = discord.Embed(title=f"🎚️ Quality set to {tier}", color=0x2ecc71)
+            embed.description = "Applies to tracks fetched from now on"
+        embed.set_footer(text=f"Tiers: {tiers}")
+        return embed
+
+    @commands.command(name="quality", help="Ganti kualitas audio: auto, low, normal, high")
+    async def quality(self, context: commands.Context, tier: str = None):
+        """Shows or sets the audio quality tier for this server"""
+        await context.send(embed=self._set_quality(context.guild.id, tier))
+
+    @discord.app_commands.command(name="quality", description="Ganti kualitas audio: auto, low, normal, high")
+    @discord.app_commands.choices(
+        tier=[discord.app_commands.Choice(name=name, value=name) for name in ("auto", *QUALITY_TIERS)]
+    )
+    async def qquality(self, interaction: discord.Interaction, tier: str = None):
+        """Shows or sets the audio quality tier for this server (slash command)"""
+        await interaction.response.send_message(embed=self._set_quality(interaction.guild.id, tier))
 
     ### QUEUE SECTION ###
 
+    def _queued_item(self, player, position: int):
+        """Item shown at position in the queue list, None if there is none. The playing track is 0"""
+        if player is None or position < 1:
+            return None
+        items = player.queue.page(position, 1)
+        return items[0] if items else None
+
+    def _remove(self, guild_id, position: int) -> discord.Embed:
+        """Removes the track at position from a guild's queue"""
+        player = self._find_player(guild_id)
+        item = self._queued_item(player, position)
+        if item is None:
+            return discord.Embed(title=f"❌ No track at position {position}", color=0x95a5a6)
+        player.remove(item.handle)
+        return discord.Embed(
+            title="🗑️ Removed from Queue", description=f"**{item.download_data['title']}**", color=0x9b59b6
+        )
+
+    def _play_next(self, guild_id, position: int) -> discord.Embed:
+        """Moves the track at position right behind the playing one"""
+        player = self._find_player(guild_id)
+        item = self._queued_item(player, position)
+        if item is None:
+            return discord.Embed(title=f"❌ No track at position {position}", color=0x95a5a6)
+        player.play_next(item.handle)
+        return discord.Embed(
+            title="⏫ Playing Next", description=f"**{item.download_data['title']}**", color=0x9b59b6
+        )
+
+    def _shuffle(self, guild_id) -> discord.Embed:
+        """Shuffles the tracks after the playing one"""
+        player = self._find_player(guild_id)
+        if player is None or len(player.queue) < 3:
+            return discord.Embed(title="❌ Not enough tracks to shuffle", color=0x95a5a6)
+        player.shuffle()
+        return discord.Embed(
+            title="🔀 Queue Shuffled", description=f"{len(player.queue) - 1} upcoming tracks", color=0x9b59b6
+        )
+
+    @commands.command(name="remove", help="Hapus lagu dari kuewe pakai nomornya di queue beb")
+    async def remove(self, context: commands.Context, position: int):
+        """Removes a track from the queue by its number in the queue list"""
+        await context.send(embed=self._remove(context.guild.id, position))
+
+    @discord.app_commands.command(name="rm", description="Hapus lagu dari kuewe pakai nomornya di queue beb")
+    @discord.app_commands.describe(position="number in the queue list")
+    async def qremove(self, interaction: discord.Interaction, position: int):
+        """Removes a track from the queue by its number in the queue list (slash command)"""
+        await interaction.response.send_message(embed=self._remove(interaction.guild.id, position))
+
+    @commands.command(name="playnext", help="Puter lagu dari kuewe abis yang sekarang beb")
+    async def playnext(self, context: commands.Context, position: int):
+        """Moves a track from the queue list to play after the current one"""
+        await context.send(embed=self._play_next(context.guild.id, position))
+
+    @discord.app_commands.command(name="pn", description="Puter lagu dari kuewe abis yang sekarang beb")
+    @discord.app_commands.describe(position="number in the queue list")
+    async def qplaynext(self, interaction: discord.Interaction, position: int):
+        """Moves a track from the queue list to play after the current one (slash command)"""
+        await interaction.response.send_message(embed=self._play_next(interaction.guild.id, position))
+
+    @commands.command(name="shuffle", help="Acak kuewe beb")
+    async def shuffle(self, context: commands.Context):
+        """Shuffles the upcoming tracks"""
+        await context.send(embed=self._shuffle(context.guild.id))
+
+    @discord.app_commands.command(name="sh", description="Acak kuewe beb")
+    async def qshuffle(self, interaction: discord.Interaction):
+        """Shuffles the upcoming tracks (slash command)"""
+        await interaction.response.send_message(embed=self._shuffle(interaction.guild.id))
+
     @commands.command(name="queue", help="Nunjukin kuewe ada sekarang beb")
     async def queue(self, context: commands.Context):
         """Gets current queue with premium UI"""
         guild_id = context.author.guild.id
+        player = self._find_player(guild_id)
 
-        if guild_id not in self.players or len(self.players[guild_id].queue) == 0:
+        if player is None or len(player.queue) == 0:
             embed = discord.Embed(title="📋 Queue", color=0x95a5a6)
             embed.add_field(name="Empty", value="No items in queue")
             await context.send(embed=embed)
         else:
-            for index, item in enumerate(self.players[guild_id].queue):
-                status = "▶️ Now Playing" if index == 0 else f"#{index} in Queue"
-                embed = discord.Embed(title=f"📋 {status}", color=0x9b59b6)
-                embed.set_author(
-                    name=context.author.display_name,
-                    icon_url=context.author.display_avatar.url,
-                )
-                
-                if 'thumbnail' in item["download_data"] and item["download_data"]['thumbnail']:
-                    embed.set_thumbnail(url=item["download_data"]['thumbnail'])
-                
-                embed.add_field(
-                    name="🎵 Title", value=item["download_data"]["title"], inline=False
-                )
-                embed.add_field(name="🔗 URL", value=f"[Link]({item['url']})", inline=False)
-                embed.add_field(
-                    name="🔊 Voice Channel",
-                    value=f"`{item['channel'].name}`",
-                    inline=False
-                )
-                await context.send(embed=embed)
+            view = QueuePageView(player, context.author)
+            await context.send(embed=view.render(), view=view)
 
     @discord.app_commands.command(name="q", description="Nunjukin kuewe yang ada sekarang beb")
     async def qqueue(self, interaction: discord.Interaction):
         """Gets current queue with premium UI (slash command)"""
         await interaction.response.defer()
         guild_id = interaction.user.guild.id
+        player = self._find_player(guild_id)
 
-        if guild_id not in self.players or len(self.players[guild_id].queue) == 0:
+        if player is None or len(player.queue) == 0:
             embed = discord.Embed(title="📋 Queue", color=0x95a5a6)
             embed.add_field(name="Empty", value="No items in queue")
             await interaction.followup.send(embed=embed)
         else:
-            embeds = []
-            for index, item in enumerate(self.players[guild_id].queue):
-                status = "▶️ Now Playing" if index == 0 else f"#{index} in Queue"
-                embed = discord.Embed(title=f"📋 {status}", color=0x9b59b6)
-                embed.set_author(
-                    name=interaction.user.display_name,
-                    icon_url=interaction.user.display_avatar.url,
-                )
-                
-                if 'thumbnail' in item["download_data"] and item["download_data"]['thumbnail']:
-                    embed.set_thumbnail(url=item["download_data"]['thumbnail'])
-                
-                embed.add_field(
-                    name="🎵 Title",
-                    value=item["download_data"]["title"],
-                    inline=False,
-                )
-                embed.add_field(name="🔗 URL", value=f"[Link]({item['url']})", inline=False)
-                embed.add_field(
-                    name="🔊 Voice Channel",
-                    value=f"`{item['channel'].name}`",
-                    inline=False
-                )
-                embeds.append(embed)
-            await interaction.followup.send(embeds=embeds)
+            view = QueuePageView(player, interaction.user)
+            await interaction.followup.send(embed=view.render(), view=view)
 
 
 async def setup(bot: commands.Bot) -> None:
@@ -0,0 +1,80 @@
+"""Youtube Progressive Playback
+    - Reads a cache file while yt-dlp is still writing it, so playback can
+      start before the download finishes
+
+"""
+import os
+import time
+
+DEFAULT_BUFFER_BYTES = 256 * 1024
+
+
+def written_bytes(path: str) -> int:
+    """Bytes on disk so far for a download into path (its .part file while running)"""
+    for candidate in (path + ".part", path):
+        try:
+            return os.path.getsize(candidate)
+        except OSError:
+            continue
+    return 0
+
+
+class TailReader:
+    """File-like reader that waits for more bytes instead of stopping at EOF
+
+    Follows yt-dlp's ``<path>.part`` and keeps reading through the open file
+    after it is renamed to path. Only returns b"" once finished is set and
+    everything has been read, or when nothing was written for stall_timeout
+    seconds. Blocks, meant for FFmpegAudio's pipe writer thread.
+
+    Arguments:
+        path (str): Final path of the download
+        finished (threading.Event): Set when the download is done, successfully or not
+        poll_interval (float): Seconds between checks for new data
+        stall_timeout (float): Seconds without new data before giving up
+    """
+
+    def __init__(self, path: str, finished, poll_interval: float = 0.05, stall_timeout: float = 60):
+        self.path = path
+        self.finished = finished
+        self.poll_interval = poll_interval
+        self.stall_timeout = stall_timeout
+        self._file = None
+        self._closed = False
+
+    def _open(self):
+        for candidate in (self.path + ".part", self.path):
+            try:
+                self._file = open(candidate, "rb")
+                return True
+            except OSError:
+                continue
+        return False
+
+    def read(self, size: int = -1) -> bytes:
+        last_data = time.monotonic()
+        while not self._closed:
+            if self._file is not None or self._open():
+                data = self._file.read(size)
+                if data:
+                    return data
+            if self.finished.is_set():
+                # Everything written before finished was set is readable now
+                if self._file is None and not self._open():
+                    return b""
+                data = self._file.read(size)
+                if not data:
+                    self.close()
+                return data
+            if time.monotonic() - last_data > self.stall_timeout:
+                print(f"download of {self.path} stalled, ending playback")
+                self.close()
+                return b""
+            time.sleep(self.poll_interval)
+        return b""
+
+    def close(self):
+        self._closed = True
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,176 @@
+"""Youtube Queue
+    - Compact queue items and an ordered queue with O(1) operations by handle
+
+"""
+import random
+import itertools
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+_handles = itertools.count(1)
+
+
+# Fields of download_data worth keeping while a track waits in the queue
+TRACK_FIELDS = (
+    "id",
+    "file",
+    "title",
+    "url",
+    "thumbnail",
+    "duration",
+    "duration_seconds",
+    "uploader",
+    "acodec",
+    "ext",
+    "stream_url",
+    "stream_expires",
+    "stream_before_options",
+    "stream_format",
+)
+
+
+# Fields saved in queue snapshots, the rest expire or point at files that may be evicted
+SNAPSHOT_FIELDS = (
+    "id",
+    "title",
+    "url",
+    "thumbnail",
+    "duration",
+    "duration_seconds",
+    "uploader",
+    "acodec",
+    "ext",
+)
+
+
+def trim_track(download_data: dict) -> dict:
+    """Copy of download_data with only TRACK_FIELDS"""
+    return {k: download_data[k] for k in TRACK_FIELDS if k in download_data}
+
+
+@dataclass(slots=True, eq=False)
+class QueueItem:
+    """One queued track. handle stays stable while the item moves around the queue
+
+    Only ids are kept, not discord objects, so a queued item doesn't pin
+    messages, members and their caches. Objects are looked up from the bot
+    cache when needed.
+    """
+
+    url: str
+    channel_id: int
+    download_data: dict
+    guild_id: int = None
+    user_id: int = None
+    text_channel_id: int = None
+    stream: bool = False
+    download_task: object = None
+    # Background download of a file played progressively, checked once the track ends
+    file_task: object = None
+    # monotonic time the play command came in, before resolving, only set if the player was idle
+    requested_at: float = None
+    # Seconds into the track to start at, set when resuming after a restart
+    seek: float = 0.0
+    handle: int = field(default_factory=lambda: next(_handles))
+
+    def snapshot(self) -> dict:
+        """JSON-able copy for queue snapshots. Files and stream urls are fetched again"""
+        return {
+            "url": self.url,
+            "channel_id": self.channel_id,
+            "guild_id": self.guild_id,
+            "user_id": self.user_id,
+            "text_channel_id": self.text_channel_id,
+            "stream": self.stream,
+            "download_data": {
+                k: v for k, v in self.download_data.items() if k in SNAPSHOT_FIELDS
+            },
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: dict, seek: float = 0.0):
+        return cls(
+            url=data["url"],
+            channel_id=data["channel_id"],
+            download_data=data["download_data"],
+            guild_id=data["guild_id"],
+            user_id=data["user_id"],
+            text_channel_id=data["text_channel_id"],
+            stream=data["stream"],
+            seek=seek,
+        )
+
+    def voice_channel(self, bot):
+        """Voice channel to play in, None if it's gone"""
+        return bot.get_channel(self.channel_id)
+
+    def text_channel(self, bot):
+        """Channel the track was requested from, None if it's gone"""
+        if self.text_channel_id is None:
+            return None
+        return bot.get_channel(self.text_channel_id)
+
+    def requester(self, bot):
+        """Member who queued the track, None if not cached"""
+        guild = bot.get_guild(self.guild_id)
+        if guild is None or self.user_id is None:
+            return None
+        return guild.get_member(self.user_id)
+
+
+class TrackQueue:
+    """Ordered queue of QueueItems keyed by handle
+
+    Append, popleft, remove and moving an item to either end are O(1).
+    Callers that need a slice use page(), which only walks what it returns.
+    """
+
+    __slots__ = ("_items",)
+
+    def __init__(self):
+        self._items = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def append(self, item: QueueItem):
+        self._items[item.handle] = item
+
+    def head(self):
+        """First item or None"""
+        if not self._items:
+            return None
+        return next(iter(self._items.values()))
+
+    def popleft(self) -> QueueItem:
+        return self._items.popitem(last=False)[1]
+
+    def get(self, handle: int):
+        return self._items.get(handle)
+
+    def remove(self, handle: int) -> QueueItem:
+        return self._items.pop(handle)
+
+    def move_to_front(self, handle: int):
+        self._items.move_to_end(handle, last=False)
+
+    def page(self, start: int, count: int) -> list:
+        """Items [start, start + count)"""
+        return list(itertools.islice(self._items.values(), start, start + count))
+
+    def shuffle(self, keep_head: bool = True):
+        """Shuffles the queue, leaving the playing item in front if keep_head"""
+        items = list(self._items.values())
+        head = items.pop(0) if keep_head and items else None
+        random.shuffle(items)
+        self._items.clear()
+        if head is not None:
+            self.append(head)
+        for item in items:
+            self.append(item)
+
+    def clear(self):
+        self._items.clear()
@@ -0,0 +1,181 @@
+"""Youtube Download Service
+    - Runs yt-dlp jobs on a dedicated worker pool
+    - Round robins between guilds so one guild can't flood the pool
+    - Reuses one YoutubeDL per worker and format
+    - Jobs run on threads, or in worker processes (see yt_workers)
+    - Coalesces identical requests that are in flight at the same time
+
+"""
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ThreadBackend:
+    """Runs jobs on a thread pool, each thread keeping its own YoutubeDL per format key
+
+    Arguments:
+        ytdl_factory: Callable taking a format key and returning a YoutubeDL
+        workers (int): Number of worker threads
+    """
+
+    def __init__(self, ytdl_factory, workers: int = 4):
+        self.ytdl_factory = ytdl_factory
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ytdb-worker")
+        self._local = threading.local()
+
+    async def run(self, fmt_key: str, fn, args):
+        """Runs fn(ytdl, *args) on a worker thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run_job, fmt_key, fn, args)
+
+    def _run_job(self, fmt_key: str, fn, args):
+        instances = getattr(self._local, "instances", None)
+        if instances is None:
+            instances = self._local.instances = {}
+        ytdl = instances.get(fmt_key)
+        if ytdl is None:
+            ytdl = instances[fmt_key] = self.ytdl_factory(fmt_key)
+        return fn(ytdl, *args)
+
+
+class DownloadService:
+    """Fair, bounded pool for yt-dlp extraction and download jobs
+
+    Jobs are queued per tag (guild id) and workers take them round robin
+    across tags. At most ``workers`` jobs are in flight at once, and of those
+    at most ``max_concurrent_downloads`` may be downloads. A worker only
+    takes a download when a download slot is free and extractions go first,
+    so a play command's extraction never waits behind prefetch downloads.
+
+    Arguments:
+        backend: ThreadBackend or ProcessBackend the jobs run on
+        workers (int): Number of jobs in flight at once
+        max_concurrent_downloads (int): Global limit on running downloads
+    """
+
+    def __init__(self, backend, workers: int = 4, max_concurrent_downloads: int = 2):
+        self.backend = backend
+        self.workers = workers
+        self.max_concurrent_downloads = max_concurrent_downloads
+        self.busy = 0
+        self.downloading = 0
+        self._queues = OrderedDict()
+        self._download_queues = OrderedDict()
+        self._ready = None
+        self._worker_tasks = []
+
+    @property
+    def queued(self) -> int:
+        """Jobs waiting for a worker"""
+        return sum(len(jobs) for jobs in self._queues.values()) + sum(
+            len(jobs) for jobs in self._download_queues.values()
+        )
+
+    def _start(self):
+        """Starts worker tasks on the running loop on first use"""
+        if self._worker_tasks:
+            return
+        self._ready = asyncio.Condition()
+        self._worker_tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+
+    async def submit(self, tag: str, fmt_key: str, fn, *args, download: bool = False):
+        """Queues fn(ytdl, *args) for tag and waits for its result
+
+        Arguments:
+            tag (str): Fairness bucket, usually the guild id
+            fmt_key (str): Picks which reused YoutubeDL the job runs with
+            fn: Blocking module level function, run on a worker
+            download (bool): Counts the job against the download limit
+        """
+        self._start()
+        future = asyncio.get_running_loop().create_future()
+        queues = self._download_queues if download else self._queues
+        queues.setdefault(tag, deque()).append((future, fmt_key, fn, args, download))
+        async with self._ready:
+            self._ready.notify()
+        return await future
+
+    def _runnable(self) -> bool:
+        return bool(self._queues) or (
+            bool(self._download_queues) and self.downloading < self.max_concurrent_downloads
+        )
+
+    def _next_job(self):
+        """Takes the next job round robin across tags, extractions before downloads"""
+        queues = self._queues or self._download_queues
+        tag, jobs = next(iter(queues.items()))
+        job = jobs.popleft()
+        if jobs:
+            queues.move_to_end(tag)
+        else:
+            del queues[tag]
+        return job
+
+    async def _worker(self):
+        while True:
+            async with self._ready:
+                await self._ready.wait_for(self._runnable)
+                future, fmt_key, fn, args, download = self._next_job()
+                if future.cancelled():
+                    continue
+                if download:
+                    self.downloading += 1
+
+            self.busy += 1
+            try:
+                result = await self.backend.run(fmt_key, fn, args)
+            except Exception as ex:
+                if not future.cancelled():
+                    future.set_exception(ex)
+            else:
+                if not future.cancelled():
+                    future.set_result(result)
+            finally:
+                self.busy -= 1
+                if download:
+                    self.downloading -= 1
+                    # A worker may be waiting for a download slot
+                    async with self._ready:
+                        self._ready.notify()
+
+
+class SingleFlight:
+    """Runs one coroutine per key at a time, concurrent callers share its result
+
+    The shared task is shielded: a caller that is cancelled stops waiting
+    but the work carries on for everyone else (and still fills the cache if
+    nobody is left). Errors are raised to every caller, and the key is free
+    again as soon as the task finishes so the next call retries.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.coalesced = 0
+
+    async def run(self, key, coro_fn):
+        """Awaits coro_fn() for key, or the call already running for key
+
+        Every caller gets its own shallow copy of a dict result.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        else:
+            self.coalesced += 1
+        result = await asyncio.shield(task)
+        if isinstance(result, dict):
+            result = dict(result)
+        return result
+
+    def _done(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Marks the exception retrieved when every caller gave up waiting
+            task.exception()
@@ -0,0 +1,120 @@
+"""Youtube Queue Snapshots
+    - Saves each guild's queue and playback position to SQLite as it changes
+    - Restores a guild's queue the first time it is used after a restart
+    - Keeps each guild's quality tier, queued tracks or not
+
+"""
+import os
+import json
+import time
+import asyncio
+import sqlite3
+
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+
+class QueueSnapshots:
+    """Per guild queue snapshots in SQLite
+
+    Players call mark_dirty() when their queue changes. Dirty players, and
+    players that are playing (their position moves), are written every
+    flush_interval seconds, one row per guild, so a restart loses at most
+    that much.
+
+    Arguments:
+        db_path (str): SQLite file
+        flush_interval (float): Seconds between writes
+    """
+
+    def __init__(self, db_path: str, flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._db = sqlite3.connect(db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS queues (guild_id INTEGER PRIMARY KEY, data TEXT, updated REAL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS guild_settings (guild_id INTEGER PRIMARY KEY, quality TEXT)"
+        )
+        self._db.commit()
+        self._dirty = {}
+        self._playing = {}
+        self._task = None
+
+    def mark_dirty(self, player):
+        """Schedules player for the next flush"""
+        self._dirty[player.guild_id] = player
+        if player.is_playing:
+            self._playing[player.guild_id] = player
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._dirty or self._playing:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Writes dirty and playing players now"""
+        players = {**self._playing, **self._dirty}
+        self._dirty.clear()
+        for guild_id, player in players.items():
+            if not player.is_playing:
+                self._playing.pop(guild_id, None)
+            snapshot = player.snapshot()
+            if snapshot["items"]:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO queues VALUES (?, ?, ?)",
+                    (guild_id, json.dumps(snapshot), time.time()),
+                )
+            else:
+                self._db.execute("DELETE FROM queues WHERE guild_id = ?", (guild_id,))
+        if players:
+            self._db.commit()
+
+    def has(self, guild_id) -> bool:
+        """Whether a queue is saved for guild_id"""
+        row = self._db.execute("SELECT 1 FROM queues WHERE guild_id = ?", (guild_id,)).fetchone()
+        return row is not None
+
+    def discard(self, guild_id):
+        """Deletes the saved queue of guild_id now, for stop"""
+        self._dirty.pop(guild_id, None)
+        self._playing.pop(guild_id, None)
+        self._db.execute("DELETE FROM queues WHERE guild_id = ?", (guild_id,))
+        self._db.commit()
+
+    def save_quality(self, guild_id, quality: str):
+        """Saves a guild's quality tier now, it changes rarely"""
+        self._db.execute("INSERT OR REPLACE INTO guild_settings VALUES (?, ?)", (guild_id, quality))
+        self._db.commit()
+
+    def restore(self, player) -> int:
+        """Loads the saved queue and quality tier into a new player. Returns the number of tracks restored"""
+        row = self._db.execute(
+            "SELECT data FROM queues WHERE guild_id = ?", (player.guild_id,)
+        ).fetchone()
+        restored = player.restore(json.loads(row[0])) if row is not None else 0
+        # Saved when changed, the copy in the queue snapshot may be older
+        row = self._db.execute(
+            "SELECT quality FROM guild_settings WHERE guild_id = ?", (player.guild_id,)
+        ).fetchone()
+        if row is not None:
+            player.quality = row[0]
+        return restored
+
+
+_snapshots = None
+
+
+def get_queue_snapshots():
+    """Returns the process wide snapshot store, None if YTDB_QUEUE_DB isn't set"""
+    global _snapshots
+    if _snapshots is None:
+        db_path = os.getenv("YTDB_QUEUE_DB")
+        if not db_path:
+            return None
+        _snapshots = QueueSnapshots(
+            db_path,
+            flush_interval=float(os.getenv("YTDB_QUEUE_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)),
+        )
+    return _snapshots
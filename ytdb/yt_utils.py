@@ -1,9 +1,73 @@
 """Youtube Utils
     - Downloads youtube video by url or search???
+    - Serves repeat requests from the on-disk audio cache
+    - Resolves direct media urls for streaming playback
+    - Starts downloads that can be played while they are written
+    - Remembers resolved metadata so repeat requests skip extraction
+    - Lists playlists lazily in growing batches
 
 """
+import os
+import re
+import time
+import shlex
 import asyncio
-import yt_dlp as youtube_dl
+import threading
+import itertools
+from urllib.parse import urlparse, parse_qs
+from .yt_cache import get_cache, format_key, outtmpl
+from .yt_metadata import MetadataCache, get_metadata_cache
+from .yt_index import get_track_index
+from .yt_metrics import EXTRACT_SECONDS, DOWNLOAD_SECONDS, DOWNLOAD_BYTES, COALESCED_REQUESTS, WORKER_RESTARTS
+from .yt_service import DownloadService, ThreadBackend, SingleFlight
+from .yt_workers import ProcessBackend
+from .yt_progressive import DEFAULT_BUFFER_BYTES, written_bytes
+
+# Audio only formats, or a small muxed file if a video has none
+FORMAT = "bestaudio/best[height<=360]/best"
+# Target audio bitrates (kbps) per quality tier. Discord voice plays at the
+# channel's bitrate (64-384 kbps), anything above it is wasted download
+QUALITY_TIERS = {"low": 64, "normal": 128, "high": 256}
+DEFAULT_QUALITY = "normal"
+
+
+def _format_options(kbps: int) -> dict:
+    """yt-dlp options preferring Opus at the bitrate closest to kbps"""
+    return {"format": FORMAT, "format_sort": ["acodec:opus", f"abr~{kbps}"]}
+
+
+def _tier_format_key(kbps: int) -> str:
+    return format_key(f"{FORMAT}|abr~{kbps}")
+
+
+# Format key -> yt-dlp options. Built at import so worker processes know them too
+FORMAT_OPTIONS = {_tier_format_key(kbps): _format_options(kbps) for kbps in QUALITY_TIERS.values()}
+
+# Signed media urls carry an "expire" param, this is the fallback if they don't
+DEFAULT_STREAM_LIFETIME = 3600
+STREAM_BEFORE_OPTIONS = "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
+# Containers FFmpeg can copy Opus packets out of
+OPUS_CONTAINERS = ("webm", "ogg", "opus", "mka")
+
+_VIDEO_ID_RE = re.compile(
+    r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/)|youtu\.be/)([0-9A-Za-z_-]{11})"
+)
+
+
+_PLAYLIST_RE = re.compile(r"youtube\.com/playlist\?(?:.*&)?list=([0-9A-Za-z_-]+)")
+
+# Format key of the flat extraction YoutubeDL used for listing playlists
+PLAYLIST_KEY = "playlist"
+# Entries listed per playlist job. Small first so playback starts quickly
+PLAYLIST_BATCH_SIZES = (5, 20, 75, 200)
+
+
+def parse_video_id(url_or_string: str):
+    """Returns the youtube video id in a url, or None for search strings etc."""
+    match = _VIDEO_ID_RE.search(url_or_string)
+    if match is None:
+        return None
+    return match.group(1)
 
 # async def download_audio_from_url(url, output_path='.', audio_format='mp3'):
 #     """
@@ -40,17 +104,46 @@ import yt_dlp as youtube_dl
 #     except Exception as e:
 #         print(f"An error occurred: {e}")
 
-async def download(url_or_string: str, tag: str = "unknown") -> str:
-    """Download from url or search string????
+def quality_format_key(quality: str = DEFAULT_QUALITY, channel_bitrate: int = None) -> str:
+    """Format key for a quality tier
+
+    "auto" picks the lowest tier at or above the voice channel's bitrate.
 
     Arguments:
-        url_or_string (str): The url of the youtube video or search???
+        quality (str): "low", "normal", "high" or "auto"
+        channel_bitrate (int): Voice channel bitrate in bits per second, for "auto"
     """
+    if quality == "auto":
+        target = (channel_bitrate or 64000) / 1000
+        tiers = sorted(QUALITY_TIERS.values())
+        kbps = next((tier for tier in tiers if tier >= target), tiers[-1])
+    else:
+        kbps = QUALITY_TIERS[quality]
+    return _tier_format_key(kbps)
+
+
+def is_playlist_url(url_or_string: str) -> bool:
+    """Whether url is a playlist page. watch urls with a list param play just the video"""
+    return _PLAYLIST_RE.search(url_or_string) is not None
+
+
+def _create_ytdl(fmt_key: str):
+    """YoutubeDL instance writing into the audio cache"""
+    # Imported on first use, yt-dlp loads hundreds of extractor modules
+    import yt_dlp as youtube_dl
+
+    if fmt_key == PLAYLIST_KEY:
+        return youtube_dl.YoutubeDL({
+            'quiet': True,
+            'cookiefile': 'cookies.txt',
+            'extract_flat': 'in_playlist',  # Only list entries, resolve them later
+            'lazy_playlist': True,
+        })
 
     # Setup options
     # youtube_dl.utils.bug_reports_message = lambda: ""
     ydl_opts = {
-        'format': 'bestaudio/best',  # Select the best audio format
+        **FORMAT_OPTIONS.get(fmt_key, {'format': FORMAT}),  # Select the audio format
         # 'postprocessors': [{
         #     'key': 'FFmpegExtractAudio',
         #     'preferredcodec': 'mp3',
@@ -58,24 +151,390 @@ async def download(url_or_string: str, tag: str = "unknown") -> str:
         # }],
         'quiet': True,
         'cookiefile': 'cookies.txt',
-        'outtmpl': '%(title)s.%(ext)s',  # Output template
+        'outtmpl': outtmpl(fmt_key),  # Output template
         'noplaylist': True,  # Don't download entire playlists
     }
-    ytdl = youtube_dl.YoutubeDL(ydl_opts)
+    return youtube_dl.YoutubeDL(ydl_opts)
+
+
+def warm_up() -> threading.Thread:
+    """Loads yt-dlp and its YouTube extractors on a background thread
+
+    Called once the bot is connected, so neither startup nor the first play
+    pays for the import. Does nothing and returns None with the process
+    backend, the workers load their own and the import would only hold the
+    GIL the event loop needs.
+    """
+    if os.getenv("YTDB_EXTRACT_BACKEND", "thread") == "process":
+        return None
+
+    def run():
+        started = time.perf_counter()
+        ytdl = _create_ytdl(quality_format_key())
+        for name in ("Youtube", "YoutubeTab", "YoutubeSearch"):
+            ytdl.get_info_extractor(name)
+        print(f"yt-dlp warmed up in {time.perf_counter() - started:.2f}s")
+
+    thread = threading.Thread(target=run, name="ytdb-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+_service = None
+# Extractions and downloads in flight, keyed by what they fetch
+_inflight = SingleFlight()
+COALESCED_REQUESTS.set_collect(lambda: _inflight.coalesced)
 
-    # Go and download based off of url_or_string in background
-    loop = asyncio.get_event_loop()
-    data = await loop.run_in_executor(
-        None, lambda: ytdl.extract_info(url_or_string, download=True)
-    )
 
+def coalesced_requests() -> int:
+    """Extractions and downloads that joined an identical one already running"""
+    return _inflight.coalesced
+
+
+def get_service() -> DownloadService:
+    """Returns the process wide download service, configured from env on first use"""
+    global _service
+    if _service is None:
+        workers = int(os.getenv("YTDB_DOWNLOAD_WORKERS", "4"))
+        if os.getenv("YTDB_EXTRACT_BACKEND", "thread") == "process":
+            backend = ProcessBackend(
+                _create_ytdl,
+                workers=workers,
+                job_timeout=float(os.getenv("YTDB_JOB_TIMEOUT", "600")),
+            )
+            WORKER_RESTARTS.set_collect(lambda: backend.restarts)
+        else:
+            backend = ThreadBackend(_create_ytdl, workers=workers)
+        _service = DownloadService(
+            backend,
+            workers=workers,
+            max_concurrent_downloads=int(os.getenv("YTDB_MAX_CONCURRENT_DOWNLOADS", "2")),
+        )
+    return _service
+
+
+# Jobs run on download service workers, possibly in another process. They only
+# take and return small picklable values, results are the dict download() returns.
+
+def _first_entry(data: dict) -> dict:
     if "entries" in data:
         # take first item from a playlist
         data = data["entries"][0]
+    return data
 
-    # Create file and return information
-    filename = ytdl.prepare_filename(data)
-    
+
+def _extract_job(ytdl, url_or_string: str) -> dict:
+    """Metadata only extraction"""
+    return build_download_data(_first_entry(ytdl.extract_info(url_or_string, download=False)))
+
+
+def _download_job(ytdl, url_or_string: str) -> dict:
+    """Extracts and downloads in one go"""
+    data = _first_entry(ytdl.extract_info(url_or_string, download=True))
+    return build_download_data(data, ytdl.prepare_filename(data))
+
+
+def _stream_job(ytdl, url_or_string: str) -> dict:
+    """Metadata plus the direct media url and headers FFmpeg needs"""
+    data = _first_entry(ytdl.extract_info(url_or_string, download=False))
+    download_data = build_download_data(data)
+    download_data["stream_url"] = data["url"]
+    download_data["stream_headers"] = data.get("http_headers") or {}
+    return download_data
+
+
+def _playlist_job(ytdl, url: str, start: int, end: int) -> list:
+    """Lists playlist entries [start, end) without resolving them"""
+    data = ytdl.extract_info(url, download=False, process=False)
+    entries = data.get("entries") or []
+    if hasattr(entries, "getslice"):
+        # PagedList only fetches the pages it needs
+        batch = entries.getslice(start, end)
+    else:
+        # Generators list from the start every time, batches grow so this stays cheap
+        batch = itertools.islice(entries, start, end)
+    return [_flat_entry_data(entry) for entry in batch if entry and entry.get("id")]
+
+
+def _flat_entry_data(entry: dict) -> dict:
+    """Download data for a playlist entry. Fully resolved once it nears the head of the queue"""
+    return {
+        "id": entry["id"],
+        "file": None,
+        "title": entry.get("title") or entry["id"],
+        "url": f"https://www.youtube.com/watch?v={entry['id']}",
+        "thumbnail": None,
+        "duration": _format_duration(entry.get("duration")),
+        "duration_seconds": entry.get("duration"),
+        "uploader": entry.get("uploader") or entry.get("channel"),
+    }
+
+
+async def iter_playlist(url: str, tag: str = "unknown", limit: int = 200):
+    """Yields lists of playlist entries as they are listed, up to limit entries
+
+    Arguments:
+        url (str): Playlist url
+        tag (str): Who asked for it (guild id), jobs are scheduled fairly per tag
+        limit (int): Most entries to list
+    """
+    start = 0
+    sizes = itertools.chain(PLAYLIST_BATCH_SIZES, itertools.repeat(PLAYLIST_BATCH_SIZES[-1]))
+    for size in sizes:
+        end = min(start + size, limit)
+        if end <= start:
+            return
+        batch = await get_service().submit(tag, PLAYLIST_KEY, _playlist_job, url, start, end)
+        if batch:
+            yield batch
+        if len(batch) < end - start:
+            return
+        start = end
+
+
+def _cached_by_url(url_or_string: str, fmt_key: str):
+    """Cache lookup that needs no yt-dlp work, only possible for video urls"""
+    video_id = parse_video_id(url_or_string)
+    if video_id is None:
+        return None
+    cache = get_cache()
+    return cache.get(cache.make_key(video_id, fmt_key))
+
+
+def _metadata_key(url_or_string: str) -> str:
+    """Metadata cache key: the video id for urls, the normalized query otherwise"""
+    video_id = parse_video_id(url_or_string)
+    if video_id is not None:
+        return MetadataCache.track_key(video_id)
+    return MetadataCache.query_key(url_or_string)
+
+
+async def _resolve_metadata(url_or_string: str, fmt_key: str, tag: str) -> dict:
+    """Metadata from the metadata cache, or from an extract job on a miss"""
+    metadata_cache = get_metadata_cache()
+    key = _metadata_key(url_or_string)
+    download_data = metadata_cache.get(key)
+    if download_data is None:
+        download_data = await _inflight.run(
+            ("extract", key), lambda: _extract(url_or_string, fmt_key, tag, key)
+        )
+    return download_data
+
+
+async def _extract(url_or_string: str, fmt_key: str, tag: str, key: str) -> dict:
+    with EXTRACT_SECONDS.time():
+        download_data = await get_service().submit(tag, fmt_key, _extract_job, url_or_string)
+    get_metadata_cache().put(key, download_data)
+    get_track_index().add(download_data)
+    return download_data
+
+
+async def resolve(url_or_string: str, tag: str = "unknown", fmt_key: str = None) -> dict:
+    """Resolve metadata for url or search string without downloading
+
+    Returns the same fields as download(). "file" is only set if the audio is
+    already in the cache, otherwise it is None and download() has to be
+    awaited before playing.
+
+    Arguments:
+        url_or_string (str): The url of the youtube video or search???
+        tag (str): Who asked for it (guild id), jobs are scheduled fairly per tag
+        fmt_key (str): quality_format_key() of the wanted quality, default tier if None
+    """
+    fmt_key = fmt_key or quality_format_key()
+    cached = _cached_by_url(url_or_string, fmt_key)
+    if cached is not None:
+        return cached
+
+    cache = get_cache()
+    download_data = await _resolve_metadata(url_or_string, fmt_key, tag)
+    cached = cache.get(cache.make_key(download_data["id"], fmt_key))
+    if cached is not None:
+        return cached
+    return download_data
+
+
+async def download(url_or_string: str, tag: str = "unknown", fmt_key: str = None) -> dict:
+    """Download from url or search string????
+
+    Files land in the audio cache. If the video is already cached, yt-dlp is
+    skipped entirely when the id can be read from the url.
+
+    Arguments:
+        url_or_string (str): The url of the youtube video or search???
+        tag (str): Who asked for it (guild id), jobs are scheduled fairly per tag
+        fmt_key (str): quality_format_key() of the wanted quality, default tier if None
+    """
+    fmt_key = fmt_key or quality_format_key()
+    cached = _cached_by_url(url_or_string, fmt_key)
+    if cached is not None:
+        return cached
+
+    video_id = parse_video_id(url_or_string)
+    if video_id is None:
+        # Resolve search strings first so they can still hit the cache
+        download_data = await _resolve_metadata(url_or_string, fmt_key, tag)
+        cached = get_cache().get(get_cache().make_key(download_data["id"], fmt_key))
+        if cached is not None:
+            return cached
+        url_or_string = download_data["url"]
+        video_id = download_data["id"]
+
+    # Concurrent plays of the same video share one download into one file
+    return await _inflight.run(
+        ("download", fmt_key, video_id), lambda: _download(url_or_string, fmt_key, tag)
+    )
+
+
+async def _download(url_or_string: str, fmt_key: str, tag: str) -> dict:
+    cache = get_cache()
+    cached = _cached_by_url(url_or_string, fmt_key)
+    if cached is not None:
+        # Finished while this call was waiting to start
+        return cached
+
+    # Go and download in background
+    print(f"[{tag}] downloading {url_or_string}")
+    with DOWNLOAD_SECONDS.time():
+        download_data = await get_service().submit(
+            tag, fmt_key, _download_job, url_or_string, download=True
+        )
+    DOWNLOAD_BYTES.observe(os.path.getsize(download_data["file"]))
+    cache.put(cache.make_key(download_data["id"], fmt_key), download_data)
+    get_metadata_cache().put(_metadata_key(url_or_string), download_data)
+    get_track_index().add(download_data)
+    return download_data
+
+
+# Downloads being played while they are written, final path -> threading.Event set when done
+_writing = {}
+
+
+def download_finished_event(path: str):
+    """threading.Event set when the download writing path is done, None if nothing is writing it"""
+    return _writing.get(path)
+
+
+async def download_progressive(
+    url_or_string: str, tag: str = "unknown", min_bytes: int = DEFAULT_BUFFER_BYTES, fmt_key: str = None
+):
+    """Starts download() and returns as soon as min_bytes of it are on disk
+
+    Returns (download_data, task). download_data["file"] is the final cache
+    path, which may still be being written. task is the running download(),
+    or None if the file is already complete. While it runs,
+    download_finished_event() returns an event for the path so readers can
+    follow the file with a TailReader. The finished file lands in the cache
+    as usual. If the download fails the partial file is deleted and the
+    error is left on task for the reader to report.
+
+    Arguments:
+        url_or_string (str): The url of the youtube video or search???
+        tag (str): Who asked for it (guild id), jobs are scheduled fairly per tag
+        min_bytes (int): Bytes to wait for, enough for the container header and some audio
+        fmt_key (str): quality_format_key() of the wanted quality, default tier if None
+    """
+    fmt_key = fmt_key or quality_format_key()
+    cached = _cached_by_url(url_or_string, fmt_key)
+    if cached is not None:
+        return cached, None
+
+    download_data = await _resolve_metadata(url_or_string, fmt_key, tag)
+    cached = get_cache().get(get_cache().make_key(download_data["id"], fmt_key))
+    if cached is not None:
+        return cached, None
+
+    path = outtmpl(fmt_key) % {"id": download_data["id"], "ext": download_data["ext"]}
+    task = asyncio.ensure_future(download(download_data["url"], tag, fmt_key))
+    finished = threading.Event()
+    _writing[path] = finished
+
+    def done(done_task):
+        finished.set()
+        if _writing.get(path) is finished:
+            del _writing[path]
+        if not done_task.cancelled() and done_task.exception() is not None:
+            # Never made it into the cache index, so nothing would evict it
+            for partial in (path + ".part", path):
+                try:
+                    os.remove(partial)
+                except OSError:
+                    pass
+
+    task.add_done_callback(done)
+    while not task.done() and written_bytes(path) < min_bytes:
+        await asyncio.wait({task}, timeout=0.05)
+    if task.done():
+        return task.result(), None
+    return dict(download_data, file=path), task
+
+
+async def resolve_stream(
+    url_or_string: str, tag: str = "unknown", min_lifetime: float = 0, fmt_key: str = None
+) -> dict:
+    """Resolve the direct audio url for streaming straight into FFmpeg
+
+    Returns the same fields as resolve() plus "stream_url", "stream_expires"
+    (unix time the signed url stops working), "stream_before_options" to
+    hand to FFmpeg and "stream_format", the format key the url was picked
+    for. Nothing is written to disk.
+
+    Arguments:
+        url_or_string (str): The url of the youtube video or search???
+        tag (str): Who asked for it (guild id), jobs are scheduled fairly per tag
+        min_lifetime (float): Seconds a cached stream url must still be valid for
+        fmt_key (str): quality_format_key() of the wanted quality, default tier if None
+    """
+    key = _metadata_key(url_or_string)
+    fmt_key = fmt_key or quality_format_key()
+    # Urls point at one format, another guild's quality tier needs its own
+    cached = get_metadata_cache().get(key, stream_margin=min_lifetime, stream_format=fmt_key)
+    if cached is not None:
+        return cached
+
+    return await _inflight.run(
+        ("stream", fmt_key, key), lambda: _resolve_stream(url_or_string, fmt_key, tag, key)
+    )
+
+
+async def _resolve_stream(url_or_string: str, fmt_key: str, tag: str, key: str) -> dict:
+    with EXTRACT_SECONDS.time():
+        download_data = await get_service().submit(tag, fmt_key, _stream_job, url_or_string)
+    stream_url = download_data["stream_url"]
+
+    before_options = STREAM_BEFORE_OPTIONS
+    headers = download_data.pop("stream_headers")
+    if headers:
+        header_lines = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        before_options += " -headers " + shlex.quote(header_lines)
+
+    download_data["stream_expires"] = _stream_expiry(stream_url)
+    download_data["stream_before_options"] = before_options
+    download_data["stream_format"] = fmt_key
+    get_metadata_cache().put(key, download_data)
+    get_track_index().add(download_data)
+    return download_data
+
+
+def _stream_expiry(stream_url: str) -> float:
+    """Unix time a signed media url expires at"""
+    expire = parse_qs(urlparse(stream_url).query).get("expire")
+    if expire:
+        try:
+            return float(expire[0])
+        except ValueError:
+            pass
+    return time.time() + DEFAULT_STREAM_LIFETIME
+
+
+def stream_is_fresh(download_data: dict, margin: float = 0) -> bool:
+    """Whether a resolved stream url is still good for at least margin seconds"""
+    expires = download_data.get("stream_expires")
+    return expires is not None and expires - margin > time.time()
+
+
+def build_download_data(data: dict, filename: str = None) -> dict:
+    """Trims yt-dlp info down to what the player and embeds need"""
     # Extract thumbnail URL (prefer highest quality available)
     thumbnail = None
     if "thumbnail" in data and data["thumbnail"]:
@@ -87,29 +546,38 @@ async def download(url_or_string: str, tag: str = "unknown") -> str:
             # Sort by width/height if available, or take the last one (usually highest quality)
             thumbnail = thumbnails[-1].get("url") if isinstance(thumbnails[-1], dict) else None
     
-    # Format duration if available
-    duration_str = None
-    if "duration" in data and data["duration"]:
-        duration_seconds = data["duration"]
-        hours = int(duration_seconds // 3600)
-        minutes = int((duration_seconds % 3600) // 60)
-        seconds = int(duration_seconds % 60)
-        if hours > 0:
-            duration_str = f"{hours}:{minutes:02d}:{seconds:02d}"
-        else:
-            duration_str = f"{minutes}:{seconds:02d}"
-    
     return {
         "id": data["id"],
         "file": filename,
         "title": data["title"],
         "url": data["webpage_url"],
         "thumbnail": thumbnail,
-        "duration": duration_str,
+        "duration": _format_duration(data.get("duration")),
+        "duration_seconds": data.get("duration"),
         "uploader": data.get("uploader"),
+        "acodec": data.get("acodec"),
+        "ext": data.get("ext"),
     }
 
 
+def _format_duration(duration_seconds):
+    """h:mm:ss or m:ss, None if unknown"""
+    if not duration_seconds:
+        return None
+    hours = int(duration_seconds // 3600)
+    minutes = int((duration_seconds % 3600) // 60)
+    seconds = int(duration_seconds % 60)
+    if hours > 0:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def is_opus(download_data: dict) -> bool:
+    """Whether the selected audio is already Opus and can be passed through without re-encoding"""
+    acodec = download_data.get("acodec") or ""
+    return acodec.startswith("opus") and download_data.get("ext") in OPUS_CONTAINERS
+
+
 if __name__ == "__main__":
     URL = str(input("Enter the URL of the video: \n>>"))
     # DEST = (
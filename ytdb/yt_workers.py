@@ -0,0 +1,128 @@
+"""Youtube Worker Processes
+    - Runs yt-dlp jobs in supervised worker processes so extraction doesn't
+      hold the GIL the discord.py event loop needs
+    - Restarts workers that crash or time out
+
+"""
+import asyncio
+import multiprocessing
+
+
+class WorkerError(Exception):
+    """A job failed inside a worker process, crashed it or timed out"""
+
+
+def _worker_main(conn, ytdl_factory):
+    """Worker process loop. Receives (fmt_key, fn, args), sends back (ok, result)"""
+    instances = {}
+    while True:
+        try:
+            fmt_key, fn, args = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            ytdl = instances.get(fmt_key)
+            if ytdl is None:
+                ytdl = instances[fmt_key] = ytdl_factory(fmt_key)
+            reply = (True, fn(ytdl, *args))
+        except Exception as ex:
+            # yt-dlp exceptions don't always pickle, only send the message back
+            reply = (False, f"{type(ex).__name__}: {ex}")
+        conn.send(reply)
+
+
+class _ProcessWorker:
+    def __init__(self, context, ytdl_factory):
+        self.context = context
+        self.ytdl_factory = ytdl_factory
+        self.process = None
+        self.conn = None
+        self.start()
+
+    def start(self):
+        self.conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_worker_main, args=(child_conn, self.ytdl_factory), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def restart(self):
+        self.conn.close()
+        self.process.kill()
+        self.process.join()
+        self.start()
+
+
+class ProcessBackend:
+    """Runs jobs in a pool of worker processes, one job per process at a time
+
+    Jobs and results cross the process boundary pickled, so jobs must be
+    module level functions returning small values (the dict download()
+    returns). A worker that dies or runs past job_timeout is killed and
+    replaced.
+
+    Arguments:
+        ytdl_factory: Module level callable taking a format key and returning a YoutubeDL
+        workers (int): Number of worker processes
+        job_timeout (float): Seconds a job may run before its worker is restarted
+    """
+
+    def __init__(self, ytdl_factory, workers: int = 4, job_timeout: float = 600):
+        self.ytdl_factory = ytdl_factory
+        self.workers = workers
+        self.job_timeout = job_timeout
+        self.restarts = 0
+        # Forking a process that runs an event loop and threads isn't safe
+        self._context = multiprocessing.get_context("spawn")
+        self._idle = None
+
+    def _start(self):
+        """Spawns the worker processes on first use"""
+        if self._idle is not None:
+            return
+        self._idle = asyncio.Queue()
+        for _ in range(self.workers):
+            self._idle.put_nowait(_ProcessWorker(self._context, self.ytdl_factory))
+
+    async def run(self, fmt_key: str, fn, args):
+        """Runs fn(ytdl, *args) in a worker process"""
+        self._start()
+        worker = await self._idle.get()
+        try:
+            worker.conn.send((fmt_key, fn, args))
+            await asyncio.wait_for(self._readable(worker.conn), self.job_timeout)
+            ok, result = worker.conn.recv()
+        except asyncio.TimeoutError:
+            self._restart(worker, "timed out")
+            raise WorkerError(f"job timed out after {self.job_timeout}s") from None
+        except (EOFError, OSError) as ex:
+            self._restart(worker, "crashed")
+            raise WorkerError(f"worker crashed: {ex}") from None
+        except asyncio.CancelledError:
+            # The job is still running and its reply would go to the next caller
+            self._restart(worker, "cancelled")
+            raise
+        finally:
+            self._idle.put_nowait(worker)
+
+        if not ok:
+            raise WorkerError(result)
+        return result
+
+    @staticmethod
+    async def _readable(conn):
+        """Waits until conn has a reply (or EOF) without blocking the loop"""
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fd = conn.fileno()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_reader(fd)
+
+    def _restart(self, worker, reason: str):
+        print(f"yt-dlp worker {worker.process.pid} {reason}, restarting")
+        self.restarts += 1
+        worker.restart()